@@ -1,9 +1,14 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from models import db
+from migrations import upgrade, check_query_plans
+from rollups import rebuild_rollups
+from search import rebuild_search_index
 import os
-from services.schedule import ScheduledJob
+import sys
+from services.schedule import scheduler
+from services.notify import dispatcher
 
 app = Flask(__name__)
 
@@ -13,7 +18,7 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db.init_app(app)
 
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor'])
 
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -23,19 +28,53 @@ from functions import (
     create_expense, get_all_expenses, get_expense, delete_expense,
     create_income, get_all_incomes, get_income, delete_income, manual_invoice,
     get_statistics, update_invoice, get_transactions, get_balance, due_reminder,
-    scan_emails, get_emails, delete_email, update_expense
+    scan_emails, get_emails, delete_email, update_expense, queue_invoice_files,
+    get_invoice_job, resume_invoice_jobs, get_qr_stats, get_invoice_pdf,
+    get_invoice_preview, start_transaction_sync, trigger_transaction_sync, get_email,
+    search_all, get_reconciliation_matches, resolve_reconciliation_match, run_reconciliation,
+    start_scheduler, get_job_runs
 )
 
+scheduler.add('due_reminder', due_reminder, hour=10, minute=0)
+scheduler.add('scan_emails', scan_emails, hour=10, minute=0)
+
 with app.app_context():
-    db.create_all()
+    upgrade()
+    start_scheduler(app)
+    resume_invoice_jobs(app)
+    start_transaction_sync(app)
+    dispatcher.start()
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply pending schema migrations."""
+    print(f"Schema is at version {upgrade()}")
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if a hot query no longer uses an index."""
+    failures = check_query_plans()
+    for name, plan in failures.items():
+        print(f"{name}: {' / '.join(plan)}")
+    if failures:
+        sys.exit(1)
+    print("All queries are index-backed")
+
+@app.cli.command('rebuild-statistics')
+def rebuild_statistics_command():
+    """Recompute the statistics rollups from the source tables."""
+    print(f"Rebuilt {rebuild_rollups()} statistics rollups")
 
-due_date_scheduler = ScheduledJob(due_reminder, hour=10, minute=0)
-email_scheduler = ScheduledJob(scan_emails, hour=10, minute=0)
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Reindex emails, transactions and invoices for full-text search."""
+    rebuild_search_index()
+    print("Rebuilt the search index")
 
 @app.route('/api/invoices', methods=['GET'])
 def api_get_invoices():
-    invoices = get_all_invoices()
-    return jsonify(invoices), 200
+    response, status_code, headers = get_all_invoices(request.args)
+    return jsonify(response), status_code, headers
 
 @app.route('/api/invoices', methods=['POST'])
 def api_create_invoice():
@@ -54,12 +93,48 @@ def api_upload_invoice():
     else:
         return jsonify({'message': 'No file in the request'}), 400
 
+@app.route('/api/invoices/upload/batch', methods=['POST'])
+def api_upload_invoices_batch():
+    files = request.files.getlist('invoices')
+    if files:
+        response, status_code = queue_invoice_files(files)
+        return jsonify(response), status_code
+    else:
+        return jsonify({'message': 'No files in the request'}), 400
+
+@app.route('/api/invoices/jobs/<string:job_id>', methods=['GET'])
+def api_get_invoice_job(job_id):
+    response, status_code = get_invoice_job(job_id)
+    return jsonify(response), status_code
+
+@app.route('/api/invoices/qr-stats', methods=['GET'])
+def api_get_qr_stats():
+    response = get_qr_stats()
+    return jsonify(response), 200
+
 @app.route('/api/invoices/<int:invoice_id>', methods=['GET'])
 def api_get_invoice(invoice_id):
     response = get_invoice(invoice_id)
     status_code = 200 if 'id' in response else 404
     return jsonify(response), status_code
 
+@app.route('/api/invoices/<int:invoice_id>/pdf', methods=['GET'])
+def api_get_invoice_pdf(invoice_id):
+    filepath, etag = get_invoice_pdf(invoice_id)
+    if not filepath:
+        return jsonify({'message': 'Invoice PDF not found'}), 404
+    # conditional=True handles Range and If-None-Match requests
+    return send_file(filepath, mimetype='application/pdf', conditional=True, etag=etag)
+
+@app.route('/api/invoices/<int:invoice_id>/preview', methods=['GET'])
+def api_get_invoice_preview(invoice_id):
+    page = request.args.get('page', 0, type=int)
+    width = request.args.get('width', 320, type=int)
+    filepath = get_invoice_preview(invoice_id, page, width)
+    if not filepath:
+        return jsonify({'message': 'Preview not found'}), 404
+    return send_file(filepath, mimetype='image/png', conditional=True, etag=os.path.basename(filepath))
+
 @app.route('/api/invoices/<int:invoice_id>', methods=['DELETE'])
 def api_delete_invoice(invoice_id):
     response, status_code = delete_invoice(invoice_id)
@@ -67,8 +142,8 @@ def api_delete_invoice(invoice_id):
 
 @app.route('/api/expenses', methods=['GET'])
 def api_get_expenses():
-    expenses = get_all_expenses()
-    return jsonify(expenses), 200
+    response, status_code, headers = get_all_expenses(request.args)
+    return jsonify(response), status_code, headers
 
 @app.route('/api/expenses', methods=['POST'])
 def api_create_expense():
@@ -95,8 +170,8 @@ def api_delete_expense(expense_id):
 
 @app.route('/api/incomes', methods=['GET'])
 def api_get_incomes():
-    incomes = get_all_incomes()
-    return jsonify(incomes), 200
+    response, status_code, headers = get_all_incomes(request.args)
+    return jsonify(response), status_code, headers
 
 @app.route('/api/incomes', methods=['POST'])
 def api_create_income():
@@ -117,8 +192,8 @@ def api_delete_income(income_id):
 
 @app.route('/api/statistics', methods=['GET'])
 def api_get_statistics():
-    response = get_statistics()
-    return jsonify(response), 200
+    response, status_code = get_statistics(request.args)
+    return jsonify(response), status_code
 
 @app.route('/api/invoices/<int:invoice_id>', methods=['PATCH'])
 def api_update_invoice(invoice_id):
@@ -128,9 +203,34 @@ def api_update_invoice(invoice_id):
 
 @app.route('/api/transactions/<string:date_from>/<string:date_to>', methods=['GET'])
 def api_get_transactions(date_from, date_to):
-    response = get_transactions(date_from, date_to)
+    response = get_transactions(date_from, date_to, request.args.get('account'))
     return jsonify(response), 200
 
+@app.route('/api/transactions/sync', methods=['POST'])
+def api_sync_transactions():
+    response, status_code = trigger_transaction_sync()
+    return jsonify(response), status_code
+
+@app.route('/api/reconciliation/matches', methods=['GET'])
+def api_get_reconciliation_matches():
+    response, status_code = get_reconciliation_matches(request.args)
+    return jsonify(response), status_code
+
+@app.route('/api/reconciliation/matches/<int:match_id>', methods=['POST'])
+def api_resolve_reconciliation_match(match_id):
+    response, status_code = resolve_reconciliation_match(match_id, request.get_json() or {})
+    return jsonify(response), status_code
+
+@app.route('/api/reconciliation/run', methods=['POST'])
+def api_run_reconciliation():
+    response, status_code = run_reconciliation()
+    return jsonify(response), status_code
+
+@app.route('/api/jobs/runs', methods=['GET'])
+def api_get_job_runs():
+    response, status_code = get_job_runs(request.args)
+    return jsonify(response), status_code
+
 @app.route('/api/balance', methods=['GET'])
 def api_get_balance():
     response = get_balance()
@@ -143,8 +243,18 @@ def api_scan_emails():
 
 @app.route('/api/emails', methods=['GET'])
 def api_get_emails():
-    response = get_emails()
-    return jsonify(response), 200
+    response, status_code, headers = get_emails(request.args)
+    return jsonify(response), status_code, headers
+
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    response, status_code, headers = search_all(request.args)
+    return jsonify(response), status_code, headers
+
+@app.route('/api/emails/<int:email_id>', methods=['GET'])
+def api_get_email(email_id):
+    response, status_code = get_email(email_id)
+    return jsonify(response), status_code
 
 @app.route('/api/emails/<string:email_id>', methods=['DELETE'])
 def api_delete_email(email_id):
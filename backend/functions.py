@@ -2,57 +2,293 @@
 
 import os
 from werkzeug.utils import secure_filename
-from models import db, Invoice, Expense, Income, Transaction, Email
-from services.invoice import InvoiceReader
+from sqlalchemy.dialects.sqlite import insert
+from models import db, Invoice, Expense, Income, Transaction, Email, InvoiceJob, ParseResult, SyncState, ReconciliationMatch, ReminderLog, JobRun
+from services.invoice import PARSER_VERSION, QRCodeExtractor
+from services.parsing import ParsingEngine
+from services.jobs import JobQueue
+from services.preview import PreviewCache
+from services.balance import BalanceCache
+from services.syncer import BackgroundSyncer
 from services.transactions import TransactionService
-from services.notify import send_discord_notification
+from services.notify import send_discord_notification, split_message
+from services.schedule import scheduler
 from services.emails import EmailService
+from rollups import apply_rollup, rollup_values, read_rollups, SOURCES
+from sync import sync_transactions, last_synced_at
+from search import search, KINDS
+from reconcile import reconcile, resolve_match
 from flask import current_app
 from datetime import datetime, timedelta
+import functools
+import threading
+import time
 import uuid
-import base64
-import json
+import hashlib
+import io
+import tempfile
 
 # Configure upload folder
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf'}
+CHUNK_SIZE = 64 * 1024
+MAX_PAGE_SIZE = 500
 
 transaction_service = TransactionService()
+parsing_engine = ParsingEngine(
+    workers=int(os.getenv('PARSER_WORKERS', 0)) or None,
+    timeout=float(os.getenv('PARSER_TIMEOUT', 60)) or None,
+    preprocess=os.getenv('QR_PREPROCESS', 'pil')
+)
+invoice_jobs = JobQueue(workers=int(os.getenv('INVOICE_JOB_WORKERS', 2)))
+preview_cache = PreviewCache(
+    os.getenv('PREVIEW_CACHE_DIR', os.path.join(UPLOAD_FOLDER, 'previews')),
+    max_bytes=int(os.getenv('PREVIEW_CACHE_MAX_MB', 200)) * 1024 * 1024
+)
+balance_cache = BalanceCache(
+    lambda: transaction_service.get_balances(),
+    os.getenv('BALANCE_CACHE_PATH', 'instance/balance.json'),
+    ttl=float(os.getenv('BALANCE_TTL', 24 * 60 * 60)),
+    retry_after=float(os.getenv('BALANCE_RETRY_AFTER', 60)),
+    version=2
+)
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def save_invoice_file(file):
+    return save_invoice_stream(file.stream)
+
+def save_invoice_stream(stream):
+    """
+    Stream a PDF to disk, hashing it on the way, and store it under its
+    SHA-256 digest so identical files share one name.
+    """
+    sha256 = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_FOLDER, suffix='.part', delete=False) as tmp:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+            tmp.write(chunk)
+
+    filename = secure_filename(sha256.hexdigest() + '.pdf')
+    os.replace(tmp.name, os.path.join(UPLOAD_FOLDER, filename))
+    return filename
+
+def find_duplicate(filename):
+    return Invoice.query.filter_by(filename=filename).first()
+
+def invoice_fields(invoice_data):
+    """Flatten a parsed Issuer into JSON-safe Invoice column values."""
+    ocr = invoice_data.data.get('ocr')
+    due_date = invoice_data.data.get('due_date')
+    return {
+        'issuer': invoice_data.name,
+        'amount': invoice_data.data.get('amount', 0.0),
+        'ocr': str(ocr) if ocr else '',
+        'bankgiro': invoice_data.data.get('bankgiro', ''),
+        'plusgiro': invoice_data.data.get('plusgiro', ''),
+        'due_date': due_date.strftime('%Y-%m-%d') if due_date else None
+    }
+
+def read_invoice_fields(filename):
+    """
+    Return the extracted fields for a stored upload, from the parse cache
+    when this file has already been parsed by the current parser version.
+    """
+    sha256 = filename.rsplit('.', 1)[0]
+    cached = db.session.get(ParseResult, (sha256, PARSER_VERSION))
+    if cached:
+        return dict(cached.data)
+
+    # Process the invoice on the parsing engine's worker pool
+    fields = invoice_fields(parsing_engine.read(os.path.join(UPLOAD_FOLDER, filename)))
+    # Another job may have parsed the same file meanwhile
+    db.session.execute(insert(ParseResult.__table__).values(
+        sha256=sha256, parser_version=PARSER_VERSION, data=dict(fields)
+    ).on_conflict_do_nothing(index_elements=['sha256', 'parser_version']))
+    return fields
+
+# Jobs run on threads, so the duplicate check and the insert must not interleave
+invoice_lock = threading.Lock()
+
+def parse_invoice(filename, email_id=None):
+    """
+    Parse a stored upload and save the resulting Invoice. Returns
+    (invoice, created); if an invoice for the same file was saved while
+    this one was parsing, that invoice is returned instead.
+    """
+    fields = read_invoice_fields(filename)
+    if fields['due_date']:
+        fields['due_date'] = datetime.strptime(fields['due_date'], '%Y-%m-%d').date()
+
+    with invoice_lock:
+        duplicate = find_duplicate(filename)
+        if duplicate:
+            db.session.commit()
+            return duplicate, False
+
+        # Create a new Invoice object and save it to the database
+        new_invoice = Invoice(filename=filename, email_id=email_id, **fields)
+        db.session.add(new_invoice)
+        apply_rollup(rollup_values(new_invoice))
+        db.session.commit()
+
+    # Render the previews now so the first view is served from cache
+    invoice_jobs.submit(preview_cache.pregenerate, os.path.join(UPLOAD_FOLDER, filename), filename.rsplit('.', 1)[0])
+    return new_invoice, True
+
 def process_invoice_file(file):
     if file.filename == '':
         return {'message': 'No file selected'}, 400
 
     if file and allowed_file(file.filename):
-        filename = secure_filename(uuid.uuid4().hex + '.pdf')
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
+        filename = save_invoice_file(file)
+        duplicate = find_duplicate(filename)
+        if duplicate:
+            return {'message': 'Invoice already uploaded', 'duplicate': True, 'invoice_id': duplicate.id}, 200
 
-        # Process the invoice using your InvoiceReader
-        invoice_data = InvoiceReader.read(filepath)
+        try:
+            invoice, created = parse_invoice(filename)
+        except TimeoutError:
+            # Keep the file: uploads are stored by content hash, so a queued
+            # job or a later upload of the same PDF may use it
+            return {'message': 'Invoice processing timed out'}, 504
+        if not created:
+            return {'message': 'Invoice already uploaded', 'duplicate': True, 'invoice_id': invoice.id}, 200
+
+        return {'message': 'Invoice uploaded and processed successfully', 'duplicate': False, 'invoice_id': invoice.id}, 201
+    else:
+        return {'message': 'Allowed file types are pdf'}, 400
 
-        # Create a new Invoice object and save it to the database
-        new_invoice = Invoice(
-            issuer=invoice_data.name,
-            amount=invoice_data.data.get('amount', 0.0),
-            ocr=str(invoice_data.data.get('ocr', '')),
-            bankgiro=invoice_data.data.get('bankgiro', ''),
-            plusgiro=invoice_data.data.get('plusgiro', ''),
-            due_date=invoice_data.data.get('due_date'),
-            filename=filename
+def queue_invoice_files(files):
+    """
+    Store the uploaded files and queue them for background parsing. Files
+    are named by content hash as they are written, so a file repeated in
+    the batch, or already queued or processing, reuses that job.
+    """
+    files = [file for file in files if file.filename != '']
+    if not files:
+        return {'message': 'No file selected'}, 400
+    if not all(allowed_file(file.filename) for file in files):
+        return {'message': 'Allowed file types are pdf'}, 400
+
+    jobs, new_jobs = {}, []
+    for file in files:
+        filename = save_invoice_file(file)
+        if filename in jobs:
+            continue
+        job = InvoiceJob.query.filter(
+            InvoiceJob.filename == filename, InvoiceJob.status.in_(['queued', 'processing'])
+        ).first()
+        if not job:
+            job = InvoiceJob(id=uuid.uuid4().hex, original_filename=file.filename, filename=filename)
+            db.session.add(job)
+            new_jobs.append(job)
+        jobs[filename] = job
+    db.session.commit()
+
+    for job in new_jobs:
+        invoice_jobs.submit(run_invoice_job, job.id)
+
+    return {'jobs': [job.to_dict() for job in jobs.values()]}, 202
+
+def queue_email_attachments(email_scanner, emails, scanned=None):
+    """
+    Store the PDF attachments of emails marked attachments_pending and queue
+    each new one for background parsing, linked to its email. scanned maps
+    message ids to attachments already listed by this scan; other emails
+    are fetched again. Each attachment is written to the upload store as it
+    arrives. An email stays pending if any of its attachments failed with a
+    transient error, so the next scan retries it. Attachments whose content
+    is already an invoice, or is already queued, are skipped by hash.
+    """
+    scanned = dict(scanned or {})
+    refetch = [email.message_id for email in emails if email.message_id not in scanned]
+    incomplete = set()
+    if refetch:
+        attachments, failed = email_scanner.get_pdf_attachments(refetch)
+        scanned.update(attachments)
+        incomplete.update(failed)
+
+    stored, refs = [], {}
+    for email in emails:
+        for attachment in scanned.get(email.message_id, []):
+            if 'data' in attachment:
+                stored.append((email, attachment['filename'], save_invoice_stream(io.BytesIO(attachment['data']))))
+            else:
+                refs[(email.message_id, attachment['attachment_id'])] = (email, attachment['filename'])
+    if refs:
+        failed = email_scanner.get_attachments(
+            refs, lambda ref, data: stored.append((*refs[ref], save_invoice_stream(io.BytesIO(data))))
         )
-        db.session.add(new_invoice)
+        incomplete.update(message_id for message_id, _ in failed)
+
+    jobs, seen = [], set()
+    for email, original_filename, filename in stored:
+        pending = InvoiceJob.query.filter(
+            InvoiceJob.filename == filename, InvoiceJob.status.in_(['queued', 'processing'])
+        ).first()
+        if filename in seen or pending or find_duplicate(filename):
+            continue
+        seen.add(filename)
+
+        job = InvoiceJob(id=uuid.uuid4().hex, original_filename=original_filename, filename=filename, email_id=email.id)
+        db.session.add(job)
+        jobs.append(job)
+    for email in emails:
+        if email.message_id not in incomplete:
+            email.attachments_pending = False
+    db.session.commit()
+
+    for job in jobs:
+        invoice_jobs.submit(run_invoice_job, job.id)
+    return len(jobs)
+
+def run_invoice_job(job_id):
+    job = db.session.get(InvoiceJob, job_id)
+    if not job or job.status not in ('queued', 'processing'):
+        return
+
+    duplicate = find_duplicate(job.filename)
+    if duplicate:
+        job.status = 'duplicate'
+        job.invoice_id = duplicate.id
+        job.progress = 100
         db.session.commit()
+        return
+
+    job.status = 'processing'
+    job.progress = 10
+    db.session.commit()
 
+    try:
+        invoice, created = parse_invoice(job.filename, job.email_id)
+    except Exception as e:
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = str(e)[:256] or e.__class__.__name__
+    else:
+        job.status = 'done' if created else 'duplicate'
+        job.invoice_id = invoice.id
+    job.progress = 100
+    db.session.commit()
 
+def resume_invoice_jobs(app):
+    """Requeue jobs that were interrupted by a restart."""
+    jobs = InvoiceJob.query.filter(InvoiceJob.status.in_(['queued', 'processing'])).all()
+    for job in jobs:
+        invoice_jobs.submit(run_invoice_job, job.id, app=app)
 
-        return {'message': 'Invoice uploaded and processed successfully'}, 201
+def get_qr_stats():
+    return QRCodeExtractor.get_tier_stats()
+
+def get_invoice_job(job_id):
+    job = db.session.get(InvoiceJob, job_id)
+    if job:
+        return job.to_dict(), 200
     else:
-        return {'message': 'Allowed file types are pdf'}, 400
+        return {'message': 'Job not found'}, 404
 
 def manual_invoice(data):
     new_invoice = Invoice(
@@ -64,40 +300,130 @@ def manual_invoice(data):
         due_date=datetime.strptime(data.get('due_date'), '%Y-%m-%d').date()
     )
     db.session.add(new_invoice)
+    apply_rollup(rollup_values(new_invoice))
     db.session.commit()
 
     return {'message': 'Invoice created successfully'}, 201
 
-def get_all_invoices():
-    invoices = Invoice.query.all()
-    return [invoice.to_dict() for invoice in invoices]
+def parse_bool(value):
+    if value.lower() in ('true', '1'):
+        return True
+    if value.lower() in ('false', '0'):
+        return False
+    raise ValueError(f"Invalid boolean: {value}")
+
+def list_rows(model, args, date_column=None, filters=None, computed=None):
+    """
+    Keyset-paginate a table straight into dicts, without loading ORM objects.
+
+    Supports ?after=<id>&limit=<n> (capped at MAX_PAGE_SIZE), ?fields= to
+    select a subset of columns, ?date_from=&date_to= on date_column, and
+    equality filters for the args named in filters (arg -> (column, parser)).
+    computed maps extra field names to SQL expressions. Returns
+    (rows, status_code, headers) with the next cursor in X-Next-Cursor.
+    """
+    columns = {column.name: getattr(model, column.name) for column in model.__table__.columns}
+    columns.update(computed or {})
+
+    try:
+        names = [name for name in args.get('fields', '').split(',') if name] or list(columns)
+        unknown = [name for name in names if name not in columns]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        if 'id' not in names:
+            names.insert(0, 'id')
+
+        query = db.session.query(*[columns[name].label(name) for name in names])
+
+        after = args.get('after', type=int)
+        if after is not None:
+            query = query.filter(model.id > after)
+        if date_column is not None:
+            if args.get('date_from'):
+                query = query.filter(date_column >= datetime.strptime(args['date_from'], '%Y-%m-%d').date())
+            if args.get('date_to'):
+                query = query.filter(date_column <= datetime.strptime(args['date_to'], '%Y-%m-%d').date())
+        for arg, (column, parse) in (filters or {}).items():
+            if arg in args:
+                query = query.filter(column == parse(args[arg]))
+
+        limit = min(args.get('limit', MAX_PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+    except ValueError as e:
+        return {'message': str(e)}, 400, {}
+
+    rows = query.order_by(model.id).limit(limit + 1).all()
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers['X-Next-Cursor'] = str(rows[-1].id)
+
+    return [
+        {name: value.isoformat() if hasattr(value, 'isoformat') else value for name, value in row._mapping.items()}
+        for row in rows
+    ], 200, headers
+
+def get_all_invoices(args):
+    return list_rows(
+        Invoice, args,
+        date_column=Invoice.due_date,
+        filters={
+            'status': (Invoice.status, parse_bool),
+            'needs_completion': (Invoice.needs_completion, parse_bool),
+            'issuer': (Invoice.issuer, str),
+        },
+        computed={'needs_completion': Invoice.needs_completion}
+    )
 
 def get_invoice(invoice_id):
     invoice = Invoice.query.get(invoice_id)
     if invoice:
         invoice_dict = invoice.to_dict()
-        filename = secure_filename(invoice_dict.get('filename'))
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        
-        if os.path.exists(filepath):
-            with open(filepath, 'rb') as f:
-                pdf_data = f.read()
-            pdf_data = base64.b64encode(pdf_data).decode('utf-8')
-            invoice_dict['pdf_data'] = pdf_data
-        else:
-            invoice_dict['pdf_data'] = None
-        
+        filepath, _ = get_invoice_pdf(invoice_id)
+        invoice_dict['pdf_url'] = f'/api/invoices/{invoice_id}/pdf' if filepath else None
         return invoice_dict
     else:
         return {'message': 'Invoice not found'}, 404
 
+def get_invoice_pdf(invoice_id):
+    """
+    Return the absolute path of an invoice's PDF and its ETag, or
+    (None, None). Uploads never change once stored, so the file name
+    doubles as the ETag.
+    """
+    invoice = Invoice.query.get(invoice_id)
+    if not invoice or not invoice.filename:
+        return None, None
+
+    filename = secure_filename(invoice.filename)
+    filepath = os.path.abspath(os.path.join(UPLOAD_FOLDER, filename))
+    if not os.path.exists(filepath):
+        return None, None
+    return filepath, filename.rsplit('.', 1)[0]
+
+def get_invoice_preview(invoice_id, page=0, width=320):
+    """Return the path of a cached PNG preview of an invoice page, or None."""
+    filepath, key = get_invoice_pdf(invoice_id)
+    if not filepath:
+        return None
+    return preview_cache.get(filepath, key, page, width)
+
 def delete_invoice(invoice_id):
     invoice = Invoice.query.get(invoice_id)
     if invoice:
         filename = secure_filename(invoice.filename)
         filepath = os.path.join(UPLOAD_FOLDER, filename)
-        if os.path.exists(filepath):
+        # Uploads are shared by content, so keep the file while anything else uses it
+        shared = Invoice.query.filter(Invoice.filename == invoice.filename, Invoice.id != invoice_id).count()
+        if os.path.exists(filepath) and not shared:
             os.remove(filepath)
+            preview_cache.discard(filename.rsplit('.', 1)[0])
+        # SQLite doesn't enforce ondelete here, so clean up the dependants by hand
+        ReconciliationMatch.query.filter_by(invoice_id=invoice.id).delete()
+        ReminderLog.query.filter_by(invoice_id=invoice.id).delete()
+        InvoiceJob.query.filter_by(invoice_id=invoice.id).update({'invoice_id': None})
+        apply_rollup(rollup_values(invoice), -1)
         db.session.delete(invoice)
         db.session.commit()
         return {'message': f'Invoice {invoice_id} deleted'}, 200
@@ -112,12 +438,12 @@ def create_expense(data):
         date=datetime.strptime(data.get('date'), '%Y-%m-%d').date()
     )
     db.session.add(new_expense)
+    apply_rollup(rollup_values(new_expense))
     db.session.commit()
     return {'message': 'Expense created successfully'}, 201
 
-def get_all_expenses():
-    expenses = Expense.query.all()
-    return [expense.to_dict() for expense in expenses]
+def get_all_expenses(args):
+    return list_rows(Expense, args, date_column=Expense.date, filters={'category': (Expense.category, str)})
 
 def get_expense(expense_id):
     expense = Expense.query.get(expense_id)
@@ -129,6 +455,7 @@ def get_expense(expense_id):
 def delete_expense(expense_id):
     expense = Expense.query.get(expense_id)
     if expense:
+        apply_rollup(rollup_values(expense), -1)
         db.session.delete(expense)
         db.session.commit()
         return {'message': f'Expense {expense_id} deleted'}, 200
@@ -143,12 +470,12 @@ def create_income(data):
         date=datetime.strptime(data.get('date'), '%Y-%m-%d').date()
     )
     db.session.add(new_income)
+    apply_rollup(rollup_values(new_income))
     db.session.commit()
     return {'message': 'Income created successfully'}, 201
 
-def get_all_incomes():
-    incomes = Income.query.all()
-    return [income.to_dict() for income in incomes]
+def get_all_incomes(args):
+    return list_rows(Income, args, date_column=Income.date, filters={'source': (Income.source, str)})
 
 def get_income(income_id):
     income = Income.query.get(income_id)
@@ -160,6 +487,7 @@ def get_income(income_id):
 def delete_income(income_id):
     income = Income.query.get(income_id)
     if income:
+        apply_rollup(rollup_values(income), -1)
         db.session.delete(income)
         db.session.commit()
         return {'message': f'Income {income_id} deleted'}, 200
@@ -169,6 +497,7 @@ def delete_income(income_id):
 def update_invoice(invoice_id, data):
     invoice = Invoice.query.get(invoice_id)
     if invoice:
+        old_rollup = rollup_values(invoice)
         # Update fields if they are provided in data
         for field in ['issuer', 'amount', 'ocr', 'bankgiro', 'plusgiro', 'due_date', 'status']:
             if field in data:
@@ -183,6 +512,11 @@ def update_invoice(invoice_id, data):
                         invoice.due_date = data[field]
                 else:
                     setattr(invoice, field, data[field])
+        # Move the record between rollup buckets if its amount, date or key changed
+        new_rollup = rollup_values(invoice)
+        if new_rollup != old_rollup:
+            apply_rollup(old_rollup, -1)
+            apply_rollup(new_rollup)
         db.session.commit()
         return {'message': f'Invoice {invoice_id} updated'}, 200
     else:
@@ -191,6 +525,7 @@ def update_invoice(invoice_id, data):
 def update_expense(expense_id, data):
     expense = Expense.query.get(expense_id)
     if expense:
+        old_rollup = rollup_values(expense)
         # Update fields if they are provided in data
         for field in ['category', 'description', 'amount', 'date']:
             if field in data:
@@ -205,24 +540,53 @@ def update_expense(expense_id, data):
                         expense.date = data[field]
                 else:
                     setattr(expense, field, data[field])
+        # Move the record between rollup buckets if its amount, date or key changed
+        new_rollup = rollup_values(expense)
+        if new_rollup != old_rollup:
+            apply_rollup(old_rollup, -1)
+            apply_rollup(new_rollup)
         db.session.commit()
         return {'message': f'Expense {expense_id} updated'}, 200
     else:
         return {'message': 'Expense not found'}, 404
 
-def get_statistics():
-    total_income = db.session.query(db.func.sum(Income.amount)).scalar()
-    total_expenses = db.session.query(db.func.sum(Expense.amount)).scalar()
-    total_invoices = db.session.query(db.func.count(Invoice.id)).scalar()
-    total_invoices_amount = db.session.query(db.func.sum(Invoice.amount)).scalar()
-    balance = get_balance()
-    return {
-        'total_income': total_income,
-        'total_expenses': total_expenses,
-        'total_invoices': total_invoices,
-        'total_invoices_amount': total_invoices_amount,
-        'balance': balance
+def get_statistics(args=None):
+    """
+    Totals are read from the statistics_rollups table, which is kept up to
+    date as records change, so this does not scan the source tables. The
+    balance is the cached one, or None with balance_error while it is
+    unavailable.
+    ?granularity=month adds per-month totals for each kind.
+    """
+    args = args or {}
+    # Only the all-time row per kind, unless month buckets are asked for
+    totals = {kind: read_rollups(kind, period='', key='').get(('', ''), (0.0, 0)) for kind in SOURCES}
+
+    statistics = {
+        'total_income': round(totals['income'][0], 2),
+        'total_expenses': round(totals['expense'][0], 2),
+        'total_invoices': totals['invoice'][1],
+        'total_invoices_amount': round(totals['invoice'][0], 2),
     }
+    # Never wait on the bank here; /api/balance serves fresh numbers
+    statistics['balance'], statistics['balance_error'] = balance_cache.peek()
+
+    if args.get('granularity') == 'month':
+        rollups = {kind: read_rollups(kind, key='') for kind in SOURCES}
+        total = lambda kind, period: round(rollups[kind].get((period, ''), (0.0, 0))[0], 2)
+        months = sorted({period for kind in rollups for period, key in rollups[kind] if period})
+        statistics['months'] = {
+            month: {
+                'income': total('income', month),
+                'expenses': total('expense', month),
+                'invoices_amount': total('invoice', month),
+            }
+            for month in months
+        }
+    elif args.get('granularity'):
+        return {'message': 'Invalid granularity. Use month.'}, 400
+
+    return statistics, 200
 
 # def tmp_transaction_data():
 #     import json
@@ -230,43 +594,132 @@ def get_statistics():
 #         data = json.load(f)
 #     return data
 
-def get_transactions(date_from, date_to):
-    transactions = db.session.query(Transaction).filter(Transaction.date >= date_from, Transaction.date <= date_to).all()
-    if not transactions or transactions[0].created_at.date() != datetime.today().date():
-        date_from_str = transactions[0].date.strftime('%Y-%m-%d') if transactions else (datetime.today() - timedelta(days=30)).strftime('%Y-%m-%d')
-        date_to_str = datetime.today().strftime('%Y-%m-%d')
-        try:
-            transactions = transaction_service.get_all(date_from=date_from_str, date_to=date_to_str)
-            # transactions = tmp_transaction_data()
-            for transaction in transactions.get('transactions').get('booked'):
-                new_transaction = Transaction(
-                    transaction_id=transaction.get('internalTransactionId'),
-                    date=datetime.strptime(transaction.get('bookingDate'), '%Y-%m-%d').date(),
-                    amount=float(transaction.get('transactionAmount').get('amount')),
-                    description=transaction.get('remittanceInformationUnstructured'),
-                    debtor=transaction.get('debtorName'),
-                    additional_info=transaction.get('additionalInformation')
-
-                )
-                db.session.add(new_transaction)
+def record_runs(name):
+    """Record each call of the decorated job as a JobRun with its duration and outcome."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            run = JobRun(name=name, started_at=datetime.now())
+            db.session.add(run)
             db.session.commit()
-        except Exception as e:
-            print("Failed to fetch transactions from the bank API")
-        
-    transactions = db.session.query(Transaction).filter(Transaction.date >= date_from, Transaction.date <= date_to).all()
-    return [transaction.to_dict() for transaction in transactions]
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+                run.status = 'succeeded'
+                return result
+            except Exception as e:
+                db.session.rollback()
+                run.status = 'failed'
+                run.error = str(e)[:512]
+                raise
+            finally:
+                run.duration = round(time.perf_counter() - start, 3)
+                db.session.add(run)
+                db.session.commit()
+        return wrapper
+    return decorator
+
+@record_runs('sync_transactions')
+def sync_bank_transactions():
+    result = sync_transactions(transaction_service)
+    print(f"Synced transactions from {len(result['accounts'])} accounts: "
+          f"{result['inserted']} new, {result['skipped']} already stored, {result['failed']} failed")
+    if result['inserted']:
+        result['reconciliation'] = reconcile()
+        print(f"Reconciled: {result['reconciliation']['paid']} invoices paid, "
+              f"{result['reconciliation']['pending']} matches to review")
+    return result
+
+transaction_syncer = BackgroundSyncer(
+    sync_bank_transactions,
+    interval=float(os.getenv('TRANSACTION_SYNC_INTERVAL', 6 * 60 * 60))
+)
+
+def start_transaction_sync(app):
+    """Start the background syncer, running right away if the last sync is stale."""
+    synced_at = last_synced_at()
+    age = (datetime.now() - synced_at).total_seconds() if synced_at else transaction_syncer.interval
+    transaction_syncer.start(app, initial_delay=transaction_syncer.interval - age)
+
+def trigger_transaction_sync():
+    transaction_syncer.trigger()
+    return {'message': 'Sync started', 'sync_in_progress': True}, 202
+
+def get_transactions(date_from, date_to, account_id=None):
+    """Serve transactions from the database only; syncing happens in the background."""
+    query = db.session.query(Transaction).filter(Transaction.date >= date_from, Transaction.date <= date_to)
+    if account_id:
+        query = query.filter(Transaction.account_id == account_id)
+    transactions = query.all()
+    synced_at = last_synced_at()
+    return {
+        'transactions': [transaction.to_dict() for transaction in transactions],
+        'last_synced_at': synced_at.isoformat() if synced_at else None,
+        'sync_in_progress': transaction_syncer.in_progress,
+        'last_sync_error': transaction_syncer.last_error,
+    }
+
+def get_reconciliation_matches(args):
+    """List reconciliation matches, by default the pending ones awaiting review."""
+    status = args.get('status', 'pending')
+    matches = ReconciliationMatch.query.filter_by(status=status).order_by(ReconciliationMatch.id).all()
+    return [match.to_dict() for match in matches], 200
+
+def resolve_reconciliation_match(match_id, data):
+    match = db.session.get(ReconciliationMatch, match_id)
+    if not match:
+        return {'message': 'Match not found'}, 404
+    if data.get('action') not in ('confirm', 'reject'):
+        return {'message': 'action must be confirm or reject'}, 400
+    if match.status != 'pending':
+        return {'message': f'Match is already {match.status}'}, 409
+    resolve_match(match, confirm=data['action'] == 'confirm')
+    return match.to_dict(), 200
+
+def run_reconciliation():
+    """Recheck every unmatched transaction, for example after adding invoices."""
+    return reconcile(full=True), 200
+
+def start_scheduler(app):
+    """Start the shared scheduler, first closing runs left open by a previous process."""
+    JobRun.query.filter_by(status='running').update({'status': 'interrupted'})
+    db.session.commit()
+    scheduler.start(app, db.engine)
+
+def get_job_runs(args):
+    """Recent job runs, newest first, with per-job timing totals and next run times."""
+    limit = min(args.get('limit', 50, type=int), 500)
+    if limit < 1:
+        return {'message': 'limit must be positive'}, 400
+    query = JobRun.query
+    if args.get('name'):
+        query = query.filter_by(name=args['name'])
+    runs = query.order_by(JobRun.started_at.desc(), JobRun.id.desc()).limit(limit).all()
+
+    stats = db.session.query(
+        JobRun.name, db.func.count(JobRun.id),
+        db.func.sum(db.case((JobRun.status == 'failed', 1), else_=0)),
+        db.func.avg(JobRun.duration), db.func.max(JobRun.duration), db.func.max(JobRun.started_at)
+    ).group_by(JobRun.name).all()
+    next_run_times = scheduler.next_run_times()
+    jobs = {
+        name: {
+            'runs': count,
+            'failures': failures,
+            'avg_duration': round(avg_duration, 3) if avg_duration is not None else None,
+            'max_duration': max_duration,
+            'last_started_at': last_started_at.isoformat() if last_started_at else None,
+            'next_run_time': next_run_times.get(name),
+        }
+        for name, count, failures, avg_duration, max_duration, last_started_at in stats
+    }
+    for name, next_run_time in next_run_times.items():
+        jobs.setdefault(name, {'runs': 0, 'next_run_time': next_run_time})
+
+    return {'jobs': jobs, 'runs': [run.to_dict() for run in runs]}, 200
 
 def get_balance():
-    with open('instance/balance.json', 'r') as f:
-        data = json.load(f)
-    lastCheck = datetime.fromisoformat(data.get('lastCheck'))
-    if (datetime.today() - lastCheck).days > 0:
-        data = transaction_service.get_balances()
-        data['lastCheck'] = datetime.now().isoformat()
-        with open('instance/balance.json', 'w') as f:
-            json.dump(data, f)
-        return data
-    return data
+    return balance_cache.get()
 
 def get_details():
     return transaction_service.get_details()
@@ -277,37 +730,144 @@ def get_metadata():
 def get_all(date_from, date_to):
     return transaction_service.get_all(date_from, date_to)
 
+REMINDER_DAYS = int(os.getenv('REMINDER_DAYS', 2))
+
+@record_runs('due_reminder')
 def due_reminder():
+    """
+    Send one digest of unpaid invoices due within REMINDER_DAYS days,
+    skipping reminders that have already gone out for the same due date.
+    """
     print("Checking for due invoices...")
-    invoices = Invoice.query.all()
+    today = datetime.today().date()
+    already_sent = db.session.query(ReminderLog.id).filter(
+        ReminderLog.invoice_id == Invoice.id,
+        ReminderLog.due_date == Invoice.due_date,
+        ReminderLog.days_left == db.func.julianday(Invoice.due_date) - db.func.julianday(today)
+    ).exists()
+    invoices = Invoice.query.filter(
+        Invoice.status == False,
+        Invoice.due_date >= today,
+        Invoice.due_date <= today + timedelta(days=REMINDER_DAYS),
+        ~already_sent
+    ).order_by(Invoice.due_date, Invoice.id).all()
+    if not invoices:
+        return {'reminders': 0}
+
+    lines = [f"**{len(invoices)} unpaid invoice{'s' if len(invoices) != 1 else ''} due soon**"]
     for invoice in invoices:
-        if invoice.due_date == datetime.today().date():
-            send_discord_notification(f"Reminder: Invoice from {invoice.issuer} is due today!")
-        elif invoice.due_date == datetime.today().date() + timedelta(days=1):
-            send_discord_notification(f"Reminder: Invoice from {invoice.issuer} is due tomorrow!")
-        elif invoice.due_date == datetime.today().date() + timedelta(days=2):
-            send_discord_notification(f"Reminder: Invoice from {invoice.issuer} is due in 2 days!")
+        days_left = (invoice.due_date - today).days
+        when = 'today' if days_left == 0 else 'tomorrow' if days_left == 1 else f'in {days_left} days'
+        amount = f" {invoice.amount:.2f} kr" if invoice.amount else ''
+        lines.append(f"• {invoice.issuer or 'Unknown issuer'}{amount}, due {when} ({invoice.due_date.isoformat()})")
+
+    # Queued messages are kept in the notification outbox until delivered
+    for message in split_message(lines):
+        send_discord_notification(message)
+    db.session.add_all(
+        ReminderLog(invoice_id=invoice.id, due_date=invoice.due_date, days_left=(invoice.due_date - today).days)
+        for invoice in invoices
+    )
+    db.session.commit()
+    return {'reminders': len(invoices)}
 
+GMAIL_HISTORY_KEY = 'emails:history_id'
+GMAIL_RETRIES_KEY = 'emails:history_retries'
+# Scans in a row that may hold the historyId back to retry failed messages
+GMAIL_MAX_RETRIES = int(os.getenv('GMAIL_MAX_RETRIES', 5))
+
+@record_runs('scan_emails')
 def scan_emails():
+    """
+    Store new keyword-matching emails. The first scan covers today; later
+    scans fetch only what Gmail reports as added since the stored historyId.
+    Attachments still pending from earlier scans are retried.
+    """
     print("Scanning emails...")
     email_scanner = EmailService()
-    date = datetime.today()
-    emails = email_scanner.get_emails_from_date(date)
-    for email in emails:
-        new_email = Email(
-            subject=email.get('subject'),
-            body=email.get('body')
+    history_id = SyncState.get(GMAIL_HISTORY_KEY)
+    retries = int(SyncState.get(GMAIL_RETRIES_KEY, 0))
+    emails, history_id, failed = email_scanner.fetch_new(
+        since=datetime.today(), history_id=history_id, keep_history=retries < GMAIL_MAX_RETRIES
+    )
+    if failed and retries >= GMAIL_MAX_RETRIES:
+        print(f"Giving up on {len(failed)} emails after {retries} retries: {', '.join(failed)}")
+    SyncState.set(GMAIL_RETRIES_KEY, str(retries + 1 if failed and retries < GMAIL_MAX_RETRIES else 0))
+
+    existing = {
+        message_id for (message_id,) in db.session.query(Email.message_id).filter(
+            Email.message_id.in_([email['message_id'] for email in emails]))
+    } if emails else set()
+    new_emails = [email for email in emails if email['message_id'] not in existing]
+    db.session.add_all(
+        Email(
+            message_id=email['message_id'],
+            subject=email['subject'],
+            sender=email['sender'],
+            received_at=email['received_at'],
+            snippet=email['snippet'],
+            body=email['body'],
+            attachments_pending=bool(email['attachments'])
         )
-        db.session.add(new_email)
+        for email in new_emails
+    )
+    if history_id:
+        SyncState.set(GMAIL_HISTORY_KEY, str(history_id))
+    # The emails commit with the history id; their pending flag makes the
+    # attachments survive a failed download or a crash before they are queued
     db.session.commit()
 
-def get_emails():
-    emails = Email.query.all()
-    return [email.to_dict() for email in emails]
+    queued = queue_email_attachments(
+        email_scanner, Email.query.filter(Email.attachments_pending == True).all(),
+        {email['message_id']: email['attachments'] for email in new_emails}
+    )
+
+    print(f"Stored {len(new_emails)} new emails, {len(emails) - len(new_emails)} already stored, "
+          f"queued {queued} invoice attachments")
+    return {'fetched': len(emails), 'inserted': len(new_emails), 'queued_invoices': queued}
+
+def get_emails(args):
+    # Bodies are in email_bodies, so listings only carry the snippet
+    return list_rows(Email, args, date_column=db.func.date(Email.created_at))
+
+def get_email(email_id):
+    email = db.session.get(Email, email_id)
+    if email:
+        return email.to_dict(body=True), 200
+    else:
+        return {'message': 'Email not found'}, 404
+
+def search_all(args):
+    """
+    Ranked full-text search over emails, transactions and invoices.
+    ?q= is required; ?types= limits the entity types and ?limit= the page
+    size. The offset of the next page is returned in X-Next-Cursor.
+    """
+    q = args.get('q', '').strip()
+    if not q:
+        return {'message': 'Missing search query'}, 400, {}
+    kinds = [kind for kind in args.get('types', '').split(',') if kind]
+    unknown = [kind for kind in kinds if kind not in KINDS]
+    if unknown:
+        return {'message': f"Unknown types: {', '.join(unknown)}"}, 400, {}
+    limit = min(args.get('limit', 20, type=int), MAX_PAGE_SIZE)
+    offset = args.get('after', 0, type=int)
+    if limit < 1 or offset < 0:
+        return {'message': 'limit must be positive'}, 400, {}
+
+    hits = search(q, kinds, limit=limit + 1, offset=offset)
+    headers = {}
+    if len(hits) > limit:
+        hits = hits[:limit]
+        headers['X-Next-Cursor'] = str(offset + limit)
+    return hits, 200, headers
 
 def delete_email(email_id):
     email = Email.query.get(email_id)
     if email:
+        # SQLite doesn't enforce ondelete here, so drop the references by hand
+        Invoice.query.filter_by(email_id=email.id).update({'email_id': None})
+        InvoiceJob.query.filter_by(email_id=email.id).update({'email_id': None})
         db.session.delete(email)
         db.session.commit()
         return {'message': f'Email {email_id} deleted'}, 200
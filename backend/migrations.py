@@ -0,0 +1,167 @@
+# migrations.py
+
+from sqlalchemy import text
+from models import db, Invoice, Expense, Income, Transaction, Email, StatisticsRollup, SyncState, EmailBody, make_snippet, ReconciliationMatch, ReminderLog, JobRun
+from rollups import rebuild_rollups
+from search import create_search_index, rebuild_search_index, drop_legacy_triggers
+from datetime import date
+
+# Schema migrations in order. The schema version is stored in SQLite's
+# user_version pragma, and upgrade() runs every migration past it. Each
+# migration must be safe to re-run, because the baseline creates tables
+# from the current models, which may already include later changes.
+MIGRATIONS = []
+
+def migration(func):
+    MIGRATIONS.append(func)
+    return func
+
+def execute(sql):
+    db.session.execute(text(sql))
+
+def create_index(name, table, *columns):
+    execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})')
+
+def table_columns(table):
+    return [row[1] for row in db.session.execute(text(f'PRAGMA table_info({table})'))]
+
+def add_column(table, column, ddl):
+    if column not in table_columns(table):
+        execute(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+
+def create_table(model):
+    model.__table__.create(db.engine, checkfirst=True)
+
+def current_version():
+    return db.session.execute(text('PRAGMA user_version')).scalar()
+
+def upgrade():
+    """Apply pending migrations and return the resulting schema version."""
+    version = current_version()
+    for number, func in enumerate(MIGRATIONS[version:], start=version + 1):
+        print(f"Applying migration {number}: {func.__name__}")
+        func()
+        execute(f'PRAGMA user_version = {number}')
+        db.session.commit()
+    return current_version()
+
+@migration
+def baseline():
+    db.create_all()
+
+@migration
+def date_and_status_indexes():
+    create_index('ix_transactions_date', 'transactions', 'date')
+    create_index('ix_expenses_date', 'expenses', 'date')
+    create_index('ix_incomes_date', 'incomes', 'date')
+    create_index('ix_invoices_status_due_date', 'invoices', 'status', 'due_date')
+    create_index('ix_invoices_due_date', 'invoices', 'due_date')
+    create_index('ix_invoices_filename', 'invoices', 'filename')
+
+@migration
+def statistics_rollups():
+    create_table(StatisticsRollup)
+    rebuild_rollups()
+
+@migration
+def sync_state():
+    create_table(SyncState)
+
+@migration
+def transaction_accounts():
+    add_column('transactions', 'account_id', 'VARCHAR(64)')
+    create_index('ix_transactions_account_id_date', 'transactions', 'account_id', 'date')
+
+@migration
+def email_message_ids():
+    add_column('emails', 'message_id', 'VARCHAR(64)')
+    execute('CREATE UNIQUE INDEX IF NOT EXISTS ix_emails_message_id ON emails (message_id)')
+
+@migration
+def invoice_source_emails():
+    add_column('invoices', 'email_id', 'INTEGER REFERENCES emails (id) ON DELETE SET NULL')
+    add_column('invoice_jobs', 'email_id', 'INTEGER REFERENCES emails (id) ON DELETE SET NULL')
+    create_index('ix_invoices_email_id', 'invoices', 'email_id')
+
+@migration
+def compressed_email_bodies():
+    create_table(EmailBody)
+    add_column('emails', 'sender', 'VARCHAR(256)')
+    add_column('emails', 'received_at', 'DATETIME')
+    add_column('emails', 'snippet', 'VARCHAR(200)')
+    if 'body' in table_columns('emails'):
+        # Move the bodies into email_bodies, compressed, then drop the column
+        emails = db.session.execute(text('SELECT id, body FROM emails')).all()
+        if emails:
+            db.session.execute(text('INSERT OR IGNORE INTO email_bodies (email_id, data) VALUES (:id, :data)'), [
+                {'id': email_id, 'data': EmailBody.from_text(body or '').data} for email_id, body in emails
+            ])
+            db.session.execute(text('UPDATE emails SET snippet = :snippet WHERE id = :id'), [
+                {'id': email_id, 'snippet': make_snippet(body)} for email_id, body in emails
+            ])
+        execute('ALTER TABLE emails DROP COLUMN body')
+
+@migration
+def search_index():
+    create_search_index()
+    rebuild_search_index()
+
+@migration
+def reconciliation_matches():
+    create_table(ReconciliationMatch)
+
+@migration
+def reminder_logs():
+    create_table(ReminderLog)
+
+@migration
+def job_runs():
+    create_table(JobRun)
+
+@migration
+def email_attachments_pending():
+    add_column('emails', 'attachments_pending', 'BOOLEAN NOT NULL DEFAULT 0')
+    execute('CREATE INDEX IF NOT EXISTS ix_emails_attachments_pending ON emails (attachments_pending) '
+            'WHERE attachments_pending = 1')
+
+@migration
+def search_index_without_udf():
+    # The old triggers called a Python function, which broke writes from other connections
+    drop_legacy_triggers()
+    create_search_index()
+    rebuild_search_index()
+
+
+# Queries that must stay index-backed, checked by check_query_plans()
+QUERY_PLAN_CHECKS = {
+    'transactions by date': lambda: db.session.query(Transaction).filter(
+        Transaction.date >= date(2024, 1, 1), Transaction.date <= date(2024, 1, 31)),
+    'account transactions by date': lambda: db.session.query(Transaction).filter(
+        Transaction.account_id == 'x', Transaction.date >= date(2024, 1, 1)),
+    'expenses by date': lambda: db.session.query(Expense).filter(
+        Expense.date >= date(2024, 1, 1), Expense.date <= date(2024, 1, 31)),
+    'incomes by date': lambda: db.session.query(Income).filter(
+        Income.date >= date(2024, 1, 1), Income.date <= date(2024, 1, 31)),
+    'unpaid invoices due soon': lambda: db.session.query(Invoice).filter(
+        Invoice.status == False, Invoice.due_date >= date(2024, 1, 1), Invoice.due_date <= date(2024, 1, 3)),
+    'invoices by due date': lambda: db.session.query(Invoice).filter(
+        Invoice.due_date >= date(2024, 1, 1), Invoice.due_date <= date(2024, 1, 31)),
+    'invoice by filename': lambda: db.session.query(Invoice).filter(Invoice.filename == 'x.pdf'),
+    'emails with pending attachments': lambda: db.session.query(Email).filter(Email.attachments_pending == True),
+}
+
+def check_query_plans():
+    """
+    Run EXPLAIN QUERY PLAN for every QUERY_PLAN_CHECKS entry and return
+    {name: plan} for those that scan a table instead of using an index.
+    """
+    # EXPLAIN does not read the database file, so a pooled connection could
+    # plan against a stale schema; reading sqlite_master refreshes it.
+    db.session.execute(text('SELECT count(*) FROM sqlite_master'))
+    failures = {}
+    for name, build in QUERY_PLAN_CHECKS.items():
+        statement = build().statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+        plan = [row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {statement}'))]
+        if any(step.startswith('SCAN') and 'USING' not in step for step in plan):
+            failures[name] = plan
+    return failures
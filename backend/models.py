@@ -1,12 +1,22 @@
 # models.py
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.ext.hybrid import hybrid_property
 from datetime import datetime
+import html
+import zlib
+import re
 
 db = SQLAlchemy()
 
 class Invoice(db.Model):
     __tablename__ = 'invoices'
+    __table_args__ = (
+        db.Index('ix_invoices_status_due_date', 'status', 'due_date'),
+        db.Index('ix_invoices_due_date', 'due_date'),
+        db.Index('ix_invoices_filename', 'filename'),
+        db.Index('ix_invoices_email_id', 'email_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     issuer = db.Column(db.String(128), nullable=True)
     amount = db.Column(db.Float, nullable=True)
@@ -17,6 +27,7 @@ class Invoice(db.Model):
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     filename = db.Column(db.String(128), nullable=False)
     status = db.Column(db.Boolean, default=False, nullable=False)  # New field
+    email_id = db.Column(db.Integer, db.ForeignKey('emails.id', ondelete='SET NULL'), nullable=True)  # Source email, if ingested from one
 
     def to_dict(self):
         return {
@@ -30,9 +41,11 @@ class Invoice(db.Model):
             'filename': self.filename,
             'created_at': self.created_at.isoformat(),
             'status': self.status,  # Include the new field in the dictionary
-            'needs_completion': self.needs_completion()
+            'email_id': self.email_id,
+            'needs_completion': self.needs_completion
         }
 
+    @hybrid_property
     def needs_completion(self):
         """
         Determine if the invoice needs completion based on certain conditions.
@@ -43,11 +56,22 @@ class Invoice(db.Model):
                self.issuer == 'Fallback' or \
                (not self.bankgiro and not self.plusgiro)
 
+    @needs_completion.expression
+    def needs_completion(cls):
+        return db.or_(
+            db.func.coalesce(cls.amount, 0) <= 0,
+            cls.due_date.is_(None),
+            db.func.coalesce(cls.ocr, '') == '',
+            db.func.coalesce(cls.issuer, '') == 'Fallback',
+            db.and_(db.func.coalesce(cls.bankgiro, '') == '', db.func.coalesce(cls.plusgiro, '') == '')
+        )
+
     def __repr__(self):
         return f'<Invoice {self.id} - {self.issuer}>'
 
 class Expense(db.Model):
     __tablename__ = 'expenses'
+    __table_args__ = (db.Index('ix_expenses_date', 'date'),)
     id = db.Column(db.Integer, primary_key=True)
     category = db.Column(db.String(64), nullable=False)
     description = db.Column(db.String(256), nullable=True)
@@ -70,6 +94,7 @@ class Expense(db.Model):
 
 class Income(db.Model):
     __tablename__ = 'incomes'
+    __table_args__ = (db.Index('ix_incomes_date', 'date'),)
     id = db.Column(db.Integer, primary_key=True)
     source = db.Column(db.String(64), nullable=False)
     description = db.Column(db.String(256), nullable=True)
@@ -93,8 +118,13 @@ class Income(db.Model):
 
 class Transaction(db.Model):
     __tablename__ = 'transactions'
+    __table_args__ = (
+        db.Index('ix_transactions_date', 'date'),
+        db.Index('ix_transactions_account_id_date', 'account_id', 'date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     transaction_id = db.Column(db.String(64), nullable=False, unique=True)
+    account_id = db.Column(db.String(64), nullable=True)
     amount = db.Column(db.Float, nullable=False)
     date = db.Column(db.Date, nullable=False)
     description = db.Column(db.String(256), nullable=True)
@@ -106,6 +136,7 @@ class Transaction(db.Model):
         return {
             'id': self.id,
             'transaction_id': self.transaction_id,
+            'account_id': self.account_id,
             'amount': self.amount,
             'date': self.date.isoformat(),
             'description': self.description,
@@ -117,20 +148,214 @@ class Transaction(db.Model):
     def __repr__(self):
         return f'<Transaction {self.id} - {self.amount}>'
 
+SNIPPET_LENGTH = 200
+
+def html_to_text(text):
+    """Strip tags, scripts and styles from an email body and collapse whitespace."""
+    text = html.unescape(re.sub(r'<(style|script)\b.*?</\1>|<[^>]+>', ' ', text or '', flags=re.S | re.I))
+    return ' '.join(text.split())
+
+def make_snippet(text):
+    """Plain-text preview of an email body, truncated to SNIPPET_LENGTH."""
+    text = html_to_text(text)
+    return text if len(text) <= SNIPPET_LENGTH else text[:SNIPPET_LENGTH - 1].rstrip() + '…'
+
 class Email(db.Model):
     __tablename__ = 'emails'
+    __table_args__ = (
+        db.Index('ix_emails_message_id', 'message_id', unique=True),
+        db.Index('ix_emails_attachments_pending', 'attachments_pending', sqlite_where=db.text('attachments_pending = 1')),
+    )
     id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.String(64), nullable=True)  # Gmail message id
     subject = db.Column(db.String(256), nullable=False)
-    body = db.Column(db.Text, nullable=False)
+    sender = db.Column(db.String(256), nullable=True)
+    received_at = db.Column(db.DateTime, nullable=True)
+    snippet = db.Column(db.String(SNIPPET_LENGTH), nullable=True)
+    # Set until every PDF attachment is stored and queued, so a failed download is retried
+    attachments_pending = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    # The body lives compressed in its own table and is only loaded when read
+    content = db.relationship('EmailBody', uselist=False, cascade='all, delete-orphan')
+
+    @property
+    def body(self):
+        return self.content.text if self.content else None
+
+    @body.setter
+    def body(self, text):
+        self.content = EmailBody.from_text(text or '')
+        if not self.snippet:
+            self.snippet = make_snippet(text)
+
+    def to_dict(self, body=False):
+        data = {
+            'id': self.id,
+            'message_id': self.message_id,
+            'subject': self.subject,
+            'sender': self.sender,
+            'received_at': self.received_at.isoformat() if self.received_at else None,
+            'snippet': self.snippet,
+            'created_at': self.created_at.isoformat(),
+        }
+        if body:
+            data['body'] = self.body
+        return data
+
+    def __repr__(self):
+        return f'<Email {self.id} - {self.subject}>'
+
+class EmailBody(db.Model):
+    __tablename__ = 'email_bodies'
+    email_id = db.Column(db.Integer, db.ForeignKey('emails.id', ondelete='CASCADE'), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed UTF-8
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(data=zlib.compress(text.encode('utf-8')))
+
+    @property
+    def text(self):
+        return zlib.decompress(self.data).decode('utf-8')
+
+    def __repr__(self):
+        return f'<EmailBody {self.email_id}>'
+
+class StatisticsRollup(db.Model):
+    __tablename__ = 'statistics_rollups'
+    __table_args__ = (db.UniqueConstraint('kind', 'period', 'key'),)
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)  # income, expense, invoice
+    period = db.Column(db.String(7), nullable=False, default='')  # YYYY-MM, or '' for all time
+    key = db.Column(db.String(128), nullable=False, default='')  # source, category or issuer, or '' for all
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<StatisticsRollup {self.kind} {self.period or "all"} {self.key or "all"}>'
+
+class SyncState(db.Model):
+    """Key/value store for sync progress, such as per-account watermarks."""
+    __tablename__ = 'sync_state'
+    key = db.Column(db.String(128), primary_key=True)
+    value = db.Column(db.String(256), nullable=True)
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+    @classmethod
+    def get(cls, key, default=None):
+        state = db.session.get(cls, key)
+        return state.value if state and state.value is not None else default
+
+    @classmethod
+    def set(cls, key, value):
+        db.session.merge(cls(key=key, value=value))
+
+    def __repr__(self):
+        return f'<SyncState {self.key}={self.value}>'
+
+class ReconciliationMatch(db.Model):
+    __tablename__ = 'reconciliation_matches'
+    __table_args__ = (
+        db.UniqueConstraint('invoice_id', 'transaction_id'),
+        db.Index('ix_reconciliation_matches_status', 'status'),
+        db.Index('ix_reconciliation_matches_transaction_id', 'transaction_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id', ondelete='CASCADE'), nullable=False)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transactions.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(db.String(16), default='pending', nullable=False)  # auto, pending, confirmed, rejected
+    reason = db.Column(db.String(32), nullable=False)  # what matched, e.g. ocr_amount
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+    invoice = db.relationship('Invoice')
+    transaction = db.relationship('Transaction')
 
     def to_dict(self):
         return {
             'id': self.id,
-            'subject': self.subject,
-            'body': self.body,
+            'status': self.status,
+            'reason': self.reason,
+            'invoice': self.invoice.to_dict(),
+            'transaction': self.transaction.to_dict(),
+            'created_at': self.created_at.isoformat(),
+        }
+
+    def __repr__(self):
+        return f'<ReconciliationMatch {self.invoice_id} - {self.transaction_id} {self.status}>'
+
+class ReminderLog(db.Model):
+    """A due-date reminder that has been sent, so reruns skip it."""
+    __tablename__ = 'reminder_logs'
+    __table_args__ = (db.UniqueConstraint('invoice_id', 'due_date', 'days_left'),)
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id', ondelete='CASCADE'), nullable=False)
+    due_date = db.Column(db.Date, nullable=False)
+    days_left = db.Column(db.Integer, nullable=False)
+    sent_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+    def __repr__(self):
+        return f'<ReminderLog {self.invoice_id} - {self.days_left} days>'
+
+class JobRun(db.Model):
+    """One run of a scheduled or background job, for timing and failure history."""
+    __tablename__ = 'job_runs'
+    __table_args__ = (db.Index('ix_job_runs_name_started_at', 'name', 'started_at'),)
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(16), default='running', nullable=False)  # running, succeeded, failed, interrupted
+    started_at = db.Column(db.DateTime, nullable=False)
+    duration = db.Column(db.Float, nullable=True)  # seconds
+    error = db.Column(db.String(512), nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'started_at': self.started_at.isoformat(),
+            'duration': self.duration,
+            'error': self.error,
+        }
+
+    def __repr__(self):
+        return f'<JobRun {self.name} - {self.status}>'
+
+class ParseResult(db.Model):
+    __tablename__ = 'parse_results'
+    sha256 = db.Column(db.String(64), primary_key=True)
+    parser_version = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+    def __repr__(self):
+        return f'<ParseResult {self.sha256[:12]} v{self.parser_version}>'
+
+class InvoiceJob(db.Model):
+    __tablename__ = 'invoice_jobs'
+    id = db.Column(db.String(32), primary_key=True)
+    original_filename = db.Column(db.String(256), nullable=True)
+    filename = db.Column(db.String(128), nullable=False)
+    status = db.Column(db.String(16), default='queued', nullable=False)  # queued, processing, done, duplicate, failed
+    progress = db.Column(db.Integer, default=0, nullable=False)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id', ondelete='SET NULL'), nullable=True)
+    email_id = db.Column(db.Integer, db.ForeignKey('emails.id', ondelete='SET NULL'), nullable=True)
+    error = db.Column(db.String(256), nullable=True)
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'original_filename': self.original_filename,
+            'status': self.status,
+            'progress': self.progress,
+            'invoice_id': self.invoice_id,
+            'email_id': self.email_id,
+            'error': self.error,
             'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
         }
 
     def __repr__(self):
-        return f'<Email {self.id} - {self.subject}>'
\ No newline at end of file
+        return f'<InvoiceJob {self.id} - {self.status}>'
@@ -0,0 +1,128 @@
+# reconcile.py
+
+from sqlalchemy.dialects.sqlite import insert
+from models import db, Invoice, Transaction, ReconciliationMatch, SyncState
+from datetime import timedelta
+import threading
+import re
+
+# A payment counts for an invoice if it is booked within this window around the due date
+DAYS_BEFORE_DUE = 30
+DAYS_AFTER_DUE = 10
+WATERMARK_KEY = 'reconcile:last_transaction_id'
+
+OCR_PATTERN = re.compile(r'\d{2,25}')
+
+# The sync thread and the API can both start a run; they would read the same
+# watermark and suggest the same matches
+_lock = threading.Lock()
+
+def cents(amount):
+    return round(abs(amount) * 100) if amount is not None else None
+
+def in_window(invoice, transaction):
+    if not invoice.due_date:
+        return True
+    return invoice.due_date - timedelta(days=DAYS_BEFORE_DUE) <= transaction.date <= invoice.due_date + timedelta(days=DAYS_AFTER_DUE)
+
+class InvoiceIndex:
+    """Hash indexes over open invoices, by OCR number and by amount in cents."""
+
+    def __init__(self, invoices):
+        self.by_ocr = {}
+        self.by_amount = {}
+        for invoice in invoices:
+            if invoice.ocr:
+                self.by_ocr.setdefault(re.sub(r'\D', '', invoice.ocr), []).append(invoice)
+            if invoice.amount:
+                self.by_amount.setdefault(cents(invoice.amount), []).append(invoice)
+
+    def remove(self, invoice):
+        for index, key in ((self.by_ocr, re.sub(r'\D', '', invoice.ocr or '')), (self.by_amount, cents(invoice.amount))):
+            if invoice in index.get(key, []):
+                index[key].remove(invoice)
+
+    def candidates(self, transaction):
+        """
+        Return (reason, invoices, auto) for a payment: an OCR reference in
+        the text wins, then a unique amount within the date window.
+        """
+        text = ' '.join(filter(None, [transaction.description, transaction.additional_info]))
+        amount = cents(transaction.amount)
+
+        by_ocr = [invoice for number in OCR_PATTERN.findall(text) for invoice in self.by_ocr.get(number, [])]
+        if by_ocr:
+            exact = [invoice for invoice in by_ocr if cents(invoice.amount) in (None, amount)]
+            if len(exact) == 1:
+                return 'ocr_amount', exact, True
+            return 'ocr', exact or by_ocr, False
+
+        by_amount = [invoice for invoice in self.by_amount.get(amount, []) if in_window(invoice, transaction)]
+        if len(by_amount) == 1:
+            issuer = (by_amount[0].issuer or '').lower()
+            if issuer and issuer != 'fallback' and issuer in text.lower():
+                return 'amount_issuer', by_amount, True
+            return 'amount', by_amount, False
+        if by_amount:
+            return 'ambiguous', by_amount, False
+        return None, [], False
+
+def reconcile(full=False):
+    """
+    Match outgoing transactions to open invoices and mark confident
+    matches paid. Only transactions newer than the last run are checked,
+    unless full is set, which rechecks every unmatched transaction.
+    Uncertain matches are stored as pending for review. Returns counts.
+    """
+    with _lock:
+        return _reconcile(full)
+
+def _reconcile(full):
+    query = Transaction.query.filter(Transaction.amount < 0)
+    if not full:
+        query = query.filter(Transaction.id > int(SyncState.get(WATERMARK_KEY, 0)))
+    matched = db.session.query(ReconciliationMatch.transaction_id).filter(ReconciliationMatch.status != 'rejected')
+    transactions = query.filter(Transaction.id.notin_(matched)).order_by(Transaction.date).all()
+
+    index = InvoiceIndex(Invoice.query.filter(Invoice.status == False).all())
+    existing = set(db.session.query(ReconciliationMatch.invoice_id, ReconciliationMatch.transaction_id))
+    paid = pending = 0
+    for transaction in transactions:
+        reason, invoices, auto = index.candidates(transaction)
+        for invoice in invoices:
+            if (invoice.id, transaction.id) in existing:
+                continue
+            # Skip a match another process has stored since, as store_transactions does
+            inserted = db.session.execute(insert(ReconciliationMatch.__table__).values(
+                invoice_id=invoice.id, transaction_id=transaction.id, reason=reason,
+                status='auto' if auto else 'pending'
+            ).on_conflict_do_nothing(index_elements=['invoice_id', 'transaction_id'])).rowcount
+            if not inserted:
+                continue
+            if auto:
+                invoice.status = True
+                index.remove(invoice)
+                paid += 1
+            else:
+                pending += 1
+
+    last_id = db.session.query(db.func.max(Transaction.id)).scalar()
+    if last_id:
+        SyncState.set(WATERMARK_KEY, str(last_id))
+    db.session.commit()
+    return {'checked': len(transactions), 'paid': paid, 'pending': pending}
+
+def resolve_match(match, confirm):
+    """Confirm a pending match, marking its invoice paid, or reject it."""
+    if confirm:
+        match.status = 'confirmed'
+        match.invoice.status = True
+        # Other suggestions for the same invoice or payment no longer apply
+        ReconciliationMatch.query.filter(
+            ReconciliationMatch.status == 'pending', ReconciliationMatch.id != match.id,
+            db.or_(ReconciliationMatch.invoice_id == match.invoice_id,
+                   ReconciliationMatch.transaction_id == match.transaction_id)
+        ).update({'status': 'rejected'}, synchronize_session=False)
+    else:
+        match.status = 'rejected'
+    db.session.commit()
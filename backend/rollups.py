@@ -0,0 +1,85 @@
+# rollups.py
+
+from sqlalchemy.dialects.sqlite import insert
+from models import db, Invoice, Expense, Income, StatisticsRollup
+
+# kind -> (model, date column, bucket key column)
+SOURCES = {
+    'income': (Income, Income.date, Income.source),
+    'expense': (Expense, Expense.date, Expense.category),
+    'invoice': (Invoice, Invoice.due_date, Invoice.issuer),
+}
+
+def rollup_values(record):
+    """Return the (kind, amount, month, key) a record contributes to the rollups."""
+    for kind, (model, date_column, key_column) in SOURCES.items():
+        if isinstance(record, model):
+            date = getattr(record, date_column.key)
+            return (
+                kind,
+                float(record.amount or 0),
+                date.strftime('%Y-%m') if date else None,
+                getattr(record, key_column.key)
+            )
+    raise TypeError(f"No rollup for {type(record).__name__}")
+
+def buckets(month, key):
+    """The (period, key) buckets a record counts towards; '' means all."""
+    periods = [''] + ([month] if month else [])
+    keys = [''] + ([key] if key else [])
+    return [(period, bucket_key) for period in periods for bucket_key in keys]
+
+def apply_rollup(values, sign=1):
+    """
+    Add (sign=1) or remove (sign=-1) a record's rollup values in the current
+    session, so the change commits or rolls back with the record itself.
+    """
+    kind, amount, month, key = values
+    for period, bucket_key in buckets(month, key):
+        statement = insert(StatisticsRollup).values(
+            kind=kind, period=period, key=bucket_key, total=sign * amount, count=sign
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=['kind', 'period', 'key'],
+            set_={
+                'total': StatisticsRollup.total + statement.excluded.total,
+                'count': StatisticsRollup.count + statement.excluded.count,
+            }
+        )
+        db.session.execute(statement)
+
+    if sign < 0:
+        # Drop buckets that no longer count any records
+        db.session.query(StatisticsRollup).filter(
+            StatisticsRollup.kind == kind, StatisticsRollup.count <= 0
+        ).delete(synchronize_session=False)
+
+def rebuild_rollups():
+    """Recompute every rollup from the source tables and return the bucket count."""
+    db.session.query(StatisticsRollup).delete()
+    totals = {}
+    for kind, (model, date_column, key_column) in SOURCES.items():
+        month = db.func.strftime('%Y-%m', date_column)
+        rows = db.session.query(
+            month, key_column, db.func.sum(db.func.coalesce(model.amount, 0)), db.func.count(model.id)
+        ).group_by(month, key_column)
+        for row_month, key, total, count in rows:
+            for period, bucket_key in buckets(row_month, key):
+                bucket_total, bucket_count = totals.get((kind, period, bucket_key), (0.0, 0))
+                totals[(kind, period, bucket_key)] = (bucket_total + total, bucket_count + count)
+
+    db.session.add_all(
+        StatisticsRollup(kind=kind, period=period, key=key, total=total, count=count)
+        for (kind, period, key), (total, count) in totals.items()
+    )
+    db.session.commit()
+    return len(totals)
+
+def read_rollups(kind, period=None, key=None):
+    """Return {(period, key): (total, count)} for a kind, optionally one period and key."""
+    query = db.session.query(StatisticsRollup).filter(StatisticsRollup.kind == kind)
+    if period is not None:
+        query = query.filter(StatisticsRollup.period == period)
+    if key is not None:
+        query = query.filter(StatisticsRollup.key == key)
+    return {(row.period, row.key): (row.total, row.count) for row in query}
@@ -0,0 +1,139 @@
+# search.py
+
+from sqlalchemy import event, text
+from models import db, html_to_text, EmailBody
+import zlib
+
+# One FTS5 table indexes every searchable entity. Rows are keyed by
+# rowid = id * 4 + code, so triggers update and delete by rowid instead of
+# scanning the unindexed kind/ref_id columns.
+#
+# Triggers are plain SQL, so any connection can write to the source tables.
+# The one exception is email bodies: they are stored compressed, so their
+# text is indexed from application code (index_email_body below). Bodies
+# written by other tools show up in search after rebuild-search-index.
+KINDS = {'email': 1, 'transaction': 2, 'invoice': 3}
+
+BATCH_SIZE = 500
+
+def email_body_text(data):
+    return html_to_text(zlib.decompress(data).decode('utf-8')) if data else ''
+
+INDEX_EMAIL_BODY = text("""
+    UPDATE search_index SET body = coalesce((SELECT sender FROM emails WHERE id = :email_id), '') || ' ' || :body
+    WHERE rowid = :email_id * 4 + 1
+""")
+
+@event.listens_for(EmailBody, 'after_insert')
+@event.listens_for(EmailBody, 'after_update')
+def index_email_body(mapper, connection, target):
+    connection.execute(INDEX_EMAIL_BODY, {'email_id': target.email_id, 'body': email_body_text(target.data)})
+
+SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        kind UNINDEXED, ref_id UNINDEXED, title, body, tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+
+    """CREATE TRIGGER IF NOT EXISTS emails_search_insert AFTER INSERT ON emails BEGIN
+        INSERT INTO search_index (rowid, kind, ref_id, title, body)
+        VALUES (new.id * 4 + 1, 'email', new.id, new.subject, coalesce(new.sender, ''));
+    END""",
+    # The body is the sender followed by the body text, so swap the sender prefix
+    """CREATE TRIGGER IF NOT EXISTS emails_search_update AFTER UPDATE OF subject, sender ON emails BEGIN
+        UPDATE search_index SET title = new.subject,
+            body = coalesce(new.sender, '') || substr(body, length(coalesce(old.sender, '')) + 1)
+        WHERE rowid = new.id * 4 + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS emails_search_delete AFTER DELETE ON emails BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 4 + 1;
+    END""",
+
+    """CREATE TRIGGER IF NOT EXISTS transactions_search_insert AFTER INSERT ON transactions BEGIN
+        INSERT INTO search_index (rowid, kind, ref_id, title, body)
+        VALUES (new.id * 4 + 2, 'transaction', new.id, coalesce(new.debtor, ''),
+                coalesce(new.description, '') || ' ' || coalesce(new.additional_info, ''));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS transactions_search_update AFTER UPDATE OF debtor, description, additional_info ON transactions BEGIN
+        UPDATE search_index SET title = coalesce(new.debtor, ''),
+            body = coalesce(new.description, '') || ' ' || coalesce(new.additional_info, '')
+        WHERE rowid = new.id * 4 + 2;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS transactions_search_delete AFTER DELETE ON transactions BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 4 + 2;
+    END""",
+
+    """CREATE TRIGGER IF NOT EXISTS invoices_search_insert AFTER INSERT ON invoices BEGIN
+        INSERT INTO search_index (rowid, kind, ref_id, title, body)
+        VALUES (new.id * 4 + 3, 'invoice', new.id, coalesce(new.issuer, ''), coalesce(new.ocr, ''));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS invoices_search_update AFTER UPDATE OF issuer, ocr ON invoices BEGIN
+        UPDATE search_index SET title = coalesce(new.issuer, ''), body = coalesce(new.ocr, '')
+        WHERE rowid = new.id * 4 + 3;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS invoices_search_delete AFTER DELETE ON invoices BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 4 + 3;
+    END""",
+]
+
+REBUILD = [
+    "DELETE FROM search_index",
+    """INSERT INTO search_index (rowid, kind, ref_id, title, body)
+       SELECT id * 4 + 1, 'email', id, subject, coalesce(sender, '') FROM emails""",
+    """INSERT INTO search_index (rowid, kind, ref_id, title, body)
+       SELECT id * 4 + 2, 'transaction', id, coalesce(debtor, ''),
+              coalesce(description, '') || ' ' || coalesce(additional_info, '')
+       FROM transactions""",
+    """INSERT INTO search_index (rowid, kind, ref_id, title, body)
+       SELECT id * 4 + 3, 'invoice', id, coalesce(issuer, ''), coalesce(ocr, '')
+       FROM invoices""",
+]
+
+def create_search_index():
+    for statement in SCHEMA:
+        db.session.execute(text(statement))
+
+# Triggers from before email bodies were indexed from application code
+LEGACY_TRIGGERS = ['emails_search_update', 'email_bodies_search_insert', 'email_bodies_search_update']
+
+def drop_legacy_triggers():
+    for trigger in LEGACY_TRIGGERS:
+        db.session.execute(text(f'DROP TRIGGER IF EXISTS {trigger}'))
+
+def rebuild_search_index():
+    """Reindex every entity from its source table."""
+    for statement in REBUILD:
+        db.session.execute(text(statement))
+    # Email bodies in batches, so only BATCH_SIZE of them are decompressed at a time
+    last_id = 0
+    while rows := db.session.execute(text(
+        'SELECT email_id, data FROM email_bodies WHERE email_id > :last_id ORDER BY email_id LIMIT :limit'
+    ), {'last_id': last_id, 'limit': BATCH_SIZE}).all():
+        db.session.execute(INDEX_EMAIL_BODY, [{'email_id': email_id, 'body': email_body_text(data)} for email_id, data in rows])
+        last_id = rows[-1][0]
+    db.session.commit()
+
+def match_query(q):
+    """Turn free text into an FTS5 query: every word must match, as a prefix."""
+    terms = [term.replace('"', '""') for term in q.split()]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def search(q, kinds=None, limit=20, offset=0):
+    """Return ranked hits for q as dicts with type, id, title, snippet and rank."""
+    filters = ''
+    params = {'q': match_query(q), 'limit': limit, 'offset': offset}
+    if kinds:
+        filters = 'AND kind IN (' + ', '.join(f':kind{index}' for index in range(len(kinds))) + ')'
+        params.update({f'kind{index}': kind for index, kind in enumerate(kinds)})
+
+    rows = db.session.execute(text(f"""
+        SELECT kind, ref_id, title, snippet(search_index, 3, '[', ']', '…', 12) AS snippet,
+               bm25(search_index, 0, 0, 4.0, 1.0) AS rank
+        FROM search_index
+        WHERE search_index MATCH :q {filters}
+        ORDER BY rank
+        LIMIT :limit OFFSET :offset
+    """), params)
+    return [
+        {'type': row.kind, 'id': row.ref_id, 'title': row.title, 'snippet': row.snippet, 'rank': round(row.rank, 4)}
+        for row in rows
+    ]
@@ -0,0 +1,130 @@
+import os
+import json
+import tempfile
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+
+
+class BalanceCache:
+    """
+    Keep the account balance in memory and refresh it at most once per ttl.
+
+    Within refresh_ahead seconds of expiry, the first reader starts a
+    background refresh and every reader still gets the cached value. Once
+    expired, one caller fetches and the others wait for the same result
+    (single flight). If a refresh fails, the stale value is served when there
+    is one. After a failed refresh, upstream is not called again for
+    retry_after seconds: readers get the stale value, or the same error
+    when there is none. A partial value, where some accounts failed
+    ('failed' is set), is only fresh for retry_after seconds before it is
+    refreshed in the background. The JSON file only persists the value across restarts and is
+    replaced atomically, and a file written with another version is ignored.
+    """
+
+    def __init__(self, fetch, path: str, ttl: float, refresh_ahead: float | None = None, version: int = 1,
+                 retry_after: float = 60):
+        self.fetch = fetch
+        self.version = version
+        self.path = os.path.abspath(path)
+        self.ttl = ttl
+        self.refresh_ahead = ttl / 10 if refresh_ahead is None else refresh_ahead
+        self._lock = threading.Lock()
+        self.retry_after = retry_after
+        self._inflight = None
+        self._failed_at = None
+        self._error = None
+        self._data, self._checked = self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version', 1) != self.version:
+                return None, None
+            return data, datetime.fromisoformat(data['lastCheck'])
+        except (FileNotFoundError, KeyError, ValueError):
+            return None, None
+
+    def save(self, data):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.part')
+        with os.fdopen(fd, 'w') as tmp:
+            json.dump(data, tmp)
+        os.replace(tmp_path, self.path)
+
+    def get(self):
+        with self._lock:
+            age = (datetime.now() - self._checked).total_seconds() if self._data else None
+            if age is not None and age < self._fresh_for():
+                return self._data
+            if self._failed_at and (datetime.now() - self._failed_at).total_seconds() < self.retry_after:
+                if self._data is None:
+                    raise self._error
+                return self._data
+            if age is not None and age < self.ttl:
+                future, owner = self._begin_refresh()
+                if owner:
+                    threading.Thread(target=self._refresh, args=(future,), daemon=True, name='balance-refresh').start()
+                return self._data
+            stale = self._data
+            future, owner = self._begin_refresh()
+
+        if owner:
+            self._refresh(future)
+        try:
+            return future.result()
+        except Exception:
+            if stale is None:
+                raise
+            return stale
+
+    def peek(self):
+        """
+        Return (value, error) without waiting on upstream: the cached value,
+        possibly stale, or None, and the last refresh error if there was one.
+        A refresh that is due starts in the background, unless a recent
+        failure is still being backed off from.
+        """
+        with self._lock:
+            now = datetime.now()
+            due = self._data is None or (now - self._checked).total_seconds() >= self._fresh_for()
+            backing_off = self._failed_at and (now - self._failed_at).total_seconds() < self.retry_after
+            if due and not backing_off:
+                future, owner = self._begin_refresh()
+                if owner:
+                    threading.Thread(target=self._refresh, args=(future,), daemon=True, name='balance-refresh').start()
+            return self._data, str(self._error) if self._error else None
+
+    def _fresh_for(self):
+        """Seconds the cached value is served before a refresh starts. Needs the lock."""
+        if self._data.get('failed'):
+            return min(self.retry_after, self.ttl - self.refresh_ahead)
+        return self.ttl - self.refresh_ahead
+
+    def _begin_refresh(self):
+        """Return the in-flight refresh and whether the caller must run it. Needs the lock."""
+        if self._inflight:
+            return self._inflight, False
+        self._inflight = Future()
+        return self._inflight, True
+
+    def _refresh(self, future):
+        try:
+            data = self.fetch()
+            checked = datetime.now()
+            data['lastCheck'] = checked.isoformat()
+            data['version'] = self.version
+            self.save(data)
+            with self._lock:
+                self._data, self._checked = data, checked
+                self._failed_at = self._error = None
+            future.set_result(data)
+        except Exception as e:
+            print(f"Failed to refresh balance: {e}")
+            with self._lock:
+                self._failed_at, self._error = datetime.now(), e
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight = None
@@ -1,29 +1,184 @@
 import os.path
 import base64
+import html
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from datetime import datetime
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+KEYWORDS = ['invoice', 'receipt', 'bill', 'faktura', 'kvitto', 'räkning', 'betalning', 'payment', 'betala']
+METADATA_HEADERS = ['Subject', 'From', 'Date']
+# Gmail accepts up to 100 calls per batch request
+BATCH_SIZE = 100
+# A batch response is read whole, so attachments go in smaller batches
+ATTACHMENT_BATCH_SIZE = 10
+
+def is_transient(exception) -> bool:
+    """Whether a failed call is worth retrying: rate limits, server and network errors."""
+    if isinstance(exception, HttpError):
+        return exception.resp.status == 429 or exception.resp.status >= 500
+    return True
 
 class EmailService:
     def __init__(self):
         self.service = self.authenticate_gmail()
 
-    def scan(self, date) -> dict:
-        keywords = ['invoice', 'receipt', 'bill', 'faktura', 'kvitto', 'räkning', 'betalning', 'payment', 'betala']
-        emails = self.get_emails_from_date(date)
-
-        filtered = []
-        for email in emails:
-            for keyword in keywords:
-                if keyword in email['subject'].lower() or keyword in email['body'].lower():
-                    filtered.append(email)
-                    break
-        
-        return filtered
+    def scan(self, date) -> list:
+        emails, _, _ = self.fetch_new(since=date)
+        return emails
+
+    def matches(self, msg) -> bool:
+        """Keyword prefilter on the metadata of a message (subject, sender and snippet)."""
+        text = ' '.join([self.get_email_subject(msg), self.get_header(msg, 'From') or '', msg.get('snippet', '')]).lower()
+        return any(keyword in text for keyword in KEYWORDS)
+
+    def fetch_new(self, since=None, history_id=None, keep_history=True):
+        """
+        Return (emails, history_id, failed) for keyword-matching messages
+        added since history_id, or received after the since date when there
+        is no history_id (or Gmail no longer has it). Messages are fetched in
+        batches, first as metadata for the prefilter and then in full for
+        the matches only. failed lists the ids that hit a transient error;
+        messages deleted since (404) are skipped. The returned history_id is
+        the one to pass next time. With keep_history it stays unchanged when
+        anything failed, so the next scan retries it.
+        """
+        start_history_id = self.service.users().getProfile(userId='me').execute()['historyId']
+
+        message_ids = None
+        if history_id:
+            try:
+                message_ids = self.list_history(history_id)
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                print("Gmail history expired, falling back to a date scan")
+        if message_ids is None:
+            message_ids = self.list_message_ids(f"after:{since.strftime('%Y/%m/%d')}" if since else None)
+
+        metadata, failed = self.batch_get(message_ids, format='metadata', metadataHeaders=METADATA_HEADERS)
+        matched = [message_id for message_id in message_ids if message_id in metadata and self.matches(metadata[message_id])]
+        messages, failed_full = self.batch_get(matched, format='full')
+        failed += failed_full
+
+        emails = [self.to_email(messages[message_id]) for message_id in matched if message_id in messages]
+        return emails, (history_id if failed and keep_history else start_history_id), failed
+
+    def list_message_ids(self, query=None):
+        """List the ids of every message matching query, following pagination."""
+        message_ids, page_token = [], None
+        while True:
+            results = self.service.users().messages().list(userId='me', q=query, pageToken=page_token).execute()
+            message_ids += [message['id'] for message in results.get('messages', [])]
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return message_ids
+
+    def list_history(self, history_id):
+        """List the ids of messages added since history_id, following pagination."""
+        message_ids, page_token = [], None
+        while True:
+            results = self.service.users().history().list(
+                userId='me', startHistoryId=history_id, historyTypes=['messageAdded'], pageToken=page_token
+            ).execute()
+            for record in results.get('history', []):
+                message_ids += [added['message']['id'] for added in record.get('messagesAdded', [])]
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return list(dict.fromkeys(message_ids))
+
+    def batch_get(self, message_ids, **params):
+        """
+        Fetch messages with batch requests; returns ({id: message}, [failed
+        ids]). Only transient failures are reported as failed; a message that
+        is gone or rejected is left out, since retrying will not help.
+        """
+        messages, failed = {}, []
+
+        def callback(request_id, response, exception):
+            if exception:
+                print(f"Failed to fetch email {request_id}: {exception}")
+                if is_transient(exception):
+                    failed.append(request_id)
+            else:
+                messages[request_id] = response
+
+        for start in range(0, len(message_ids), BATCH_SIZE):
+            batch = self.service.new_batch_http_request(callback=callback)
+            for message_id in message_ids[start:start + BATCH_SIZE]:
+                batch.add(self.service.users().messages().get(userId='me', id=message_id, **params), request_id=message_id)
+            batch.execute()
+        return messages, failed
+
+    def to_email(self, msg) -> dict:
+        return {
+            'message_id': msg['id'],
+            'subject': self.get_email_subject(msg),
+            'sender': self.get_header(msg, 'From'),
+            'received_at': datetime.fromtimestamp(int(msg['internalDate']) / 1000) if msg.get('internalDate') else None,
+            'snippet': html.unescape(msg.get('snippet', '')) or None,
+            'body': self.get_email_body(msg),
+            'attachments': self.pdf_attachments(msg),
+        }
+
+    def pdf_attachments(self, msg):
+        """List the PDF attachments of a message as dicts with filename and either attachment_id or data."""
+        attachments = []
+        parts = [msg['payload']]
+        while parts:
+            part = parts.pop(0)
+            parts += part.get('parts', [])
+            filename = part.get('filename') or ''
+            if part.get('mimeType') != 'application/pdf' and not filename.lower().endswith('.pdf'):
+                continue
+            body = part.get('body', {})
+            if body.get('attachmentId'):
+                attachments.append({'filename': filename, 'attachment_id': body['attachmentId']})
+            elif body.get('data'):
+                attachments.append({'filename': filename, 'data': base64.urlsafe_b64decode(body['data'])})
+        return attachments
+
+    def get_pdf_attachments(self, message_ids):
+        """
+        Fetch messages again for their PDF attachments. Returns
+        ({message_id: attachments}, [failed ids]) like batch_get.
+        """
+        messages, failed = self.batch_get(message_ids, format='full')
+        return {message_id: self.pdf_attachments(msg) for message_id, msg in messages.items()}, failed
+
+    def get_attachments(self, refs, handle):
+        """
+        Download attachments given as (message_id, attachment_id) pairs, in
+        batch requests so they are fetched concurrently over one connection.
+        handle(ref, data) is called as each one arrives, so the caller can
+        store it instead of holding every attachment in memory. Returns the
+        refs that failed with a transient error.
+        """
+        refs = list(refs)
+        failed = []
+
+        def callback(request_id, response, exception):
+            ref = refs[int(request_id)]
+            if exception:
+                print(f"Failed to fetch attachment {ref}: {exception}")
+                if is_transient(exception):
+                    failed.append(ref)
+            else:
+                handle(ref, base64.urlsafe_b64decode(response['data']))
+
+        for start in range(0, len(refs), ATTACHMENT_BATCH_SIZE):
+            batch = self.service.new_batch_http_request(callback=callback)
+            for index in range(start, min(start + ATTACHMENT_BATCH_SIZE, len(refs))):
+                message_id, attachment_id = refs[index]
+                batch.add(
+                    self.service.users().messages().attachments().get(userId='me', messageId=message_id, id=attachment_id),
+                    request_id=str(index)
+                )
+            batch.execute()
+        return failed
 
     def authenticate_gmail(self):
         """Authenticate the user via OAuth and return the credentials."""
@@ -48,33 +203,20 @@ class EmailService:
         return build('gmail', 'v1', credentials=creds)
 
     def get_emails_from_date(self, date):
-        """Get a list of email messages from a specific date and return their subject and body."""
-        formatted_date = date.strftime('%Y/%m/%d')
-        query = f'after:{formatted_date}'
-
-    
-        results = self.service.users().messages().list(userId='me', q=query).execute()
-        messages = results.get('messages', [])
-
-        email_list = []
-        if messages:
-            for message in messages:
-            
-                msg = self.service.users().messages().get(userId='me', id=message['id']).execute()
-                subject = self.get_email_subject(msg)
-                body = self.get_email_body(msg)
-            
-                email_list.append({'subject': subject, 'body': body})
-
-        return email_list
+        """Get every email message received after a specific date and return their subject and body."""
+        message_ids = self.list_message_ids(f"after:{date.strftime('%Y/%m/%d')}")
+        messages, _ = self.batch_get(message_ids, format='full')
+        return [self.to_email(messages[message_id]) for message_id in message_ids if message_id in messages]
+
+    def get_header(self, msg, name):
+        for header in msg['payload'].get('headers', []):
+            if header['name'].lower() == name.lower():
+                return header['value']
+        return None
 
     def get_email_subject(self, msg):
         """Extract and return the subject of the email."""
-        headers = msg['payload']['headers']
-        for header in headers:
-            if header['name'] == 'Subject':
-                return header['value']
-        return "No subject"
+        return self.get_header(msg, 'Subject') or "No subject"
 
     def get_email_body(self, msg):
         """Extract the body of the email, whether it's plain text or HTML."""
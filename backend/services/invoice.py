@@ -1,11 +1,19 @@
 import re
+import ast
+import json
 import datetime
 import pymupdf4llm
 from pyzbar.pyzbar import decode
 from PIL import Image, ImageEnhance, ImageFilter
+import numpy as np
 import io
+import threading
 import fitz
 
+# Bump whenever a change to the parsers can alter their output, so cached
+# parse results from older versions are ignored.
+PARSER_VERSION = 3
+
 MONTH_MAP = {
     'januari': 1,
     'februari': 2,
@@ -22,21 +30,34 @@ MONTH_MAP = {
 }
 
 class InvoiceReader:
-    def __init__(self, filename: str):
-        
-        qr_data = QRCodeExtractor(filename)
-
-        if qr_data.qr_data_list:
-            tmp = qr_data.qr_data_list[0]
-            self.data = {
-                'amount': tmp['due'] if tmp['due'] else None,
-                'bankgiro': tmp['acc'] if tmp['pt'] == 'BG' else None,
-                'plusgiro': tmp['acc'] if tmp['pt'] == 'PG' else None,
-                'ocr': tmp['iref'] if int(tmp['iref']) else None,
-                'due_date': datetime.datetime.strptime(tmp['ddt'], '%Y%m%d') if tmp['ddt'] else None
-            }
-        else:
-            self.data = pymupdf4llm.to_markdown(filename)
+    def __init__(self, filename: str, data: str | dict | None = None):
+        """
+        Read the invoice at filename, or wrap data that has already been
+        extracted from it (a QR payload dict or the document text). Without
+        a QR code, data stays None and the text is read by identify_issuer.
+        """
+        if data is None:
+            qr_data = QRCodeExtractor(filename)
+
+            if qr_data.qr_data_list:
+                data = self.from_qr(qr_data.qr_data_list[0])
+
+        self.filename = filename
+        self.data = data
+
+    @staticmethod
+    def from_qr(qr: dict) -> dict:
+        """
+        Map a Swedish payment QR payload to invoice data.
+        """
+        iref = str(qr.get('iref') or '')
+        return {
+            'amount': qr.get('due') or None,
+            'bankgiro': qr.get('acc') if qr.get('pt') == 'BG' else None,
+            'plusgiro': qr.get('acc') if qr.get('pt') == 'PG' else None,
+            'ocr': iref if iref.isdigit() and int(iref) else None,
+            'due_date': datetime.datetime.strptime(qr['ddt'], '%Y%m%d') if qr.get('ddt') else None
+        }
 
     @classmethod
     def read(cls, filename: str):
@@ -51,159 +72,356 @@ class InvoiceReader:
         Identify the issuer of the document and return the correct class.
         """
 
+        if self.data is None:
+            return TextReader(self.filename).read()
         if type(self.data) == str:
-            if 'www.americanexpress.se' in self.data:
-                return AmericanExpress(self.data)
-            if 'Länsförsäkringar' in self.data:
-                return Lansforsakringar(self.data)
-            if 'Transportstyrelsen' in self.data:
-                return Transportstyrelsen(self.data)
-            if 'Telenor' in self.data:
-                return Telenor(self.data)
+            return Issuer.classify(self.data)(self.data)
         return Fallback(self.data)
-        
+
+
+class TextReader:
+    """
+    Extract issuer fields from a PDF's text layer one page at a time.
+
+    Pages are read with plain fitz text extraction and fed to issuer
+    detection and field extraction as they come, stopping once the issuer
+    is known and all of its fields are filled. Only if fields are still
+    missing after that are pages converted with pymupdf4llm, in order and
+    skipping pages without text, until they are filled.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.issuer = None
+        self.text = ''
+        self.data = {}
+
+    def read(self):
+        with fitz.open(self.filename) as pdf_file:
+            text_pages = []
+            for page in pdf_file:
+                page_text = page.get_text()
+                text_pages.append(bool(page_text.strip()))
+                if self.feed(page_text):
+                    return self.result()
+
+            if self.issuer is None and len(Fallback.extract_data(self.text)) == len(Fallback.patterns):
+                return self.result()
+
+            for page_index, has_text in enumerate(text_pages):
+                if not has_text:
+                    continue
+                markdown = pymupdf4llm.to_markdown(pdf_file, pages=[page_index], show_progress=False)
+                if self.feed(markdown):
+                    return self.result()
+
+        return self.result()
+
+    def feed(self, page_text: str) -> bool:
+        """Add one page of text, returning True once every field is filled."""
+        self.text += page_text
+        if self.issuer is None:
+            issuer = Issuer.classify(self.text)
+            if issuer is Fallback:
+                return False
+            self.issuer = issuer
+            page_text = self.text
+        self.issuer.extract_data(page_text, self.data)
+        return len(self.data) == len(self.issuer.patterns)
+
+    def result(self):
+        if self.issuer is None:
+            return Fallback(self.text)
+        return self.issuer(self.issuer.format(self.data))
+
+
+# Issuers with an anchor, in classification priority order
+ISSUERS = []
 
 class Issuer():
-    def __init__(self, patterns: list, format_functions: dict, data: str | dict):
+    """
+    Base class for invoice issuers, declared with class attributes:
+      anchor           - text identifying the issuer's documents
+      patterns         - field name -> regex matching that field
+      format_functions - field name -> function parsing the matched text
+    Patterns are compiled once when the class is defined, and subclasses
+    with an anchor are registered in ISSUERS in definition order.
+    """
+
+    anchor = None
+    patterns = {}
+    format_functions = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.compiled = {key: re.compile(pattern) for key, pattern in cls.patterns.items()}
+        if cls.anchor:
+            ISSUERS.append(cls)
+
+    def __init__(self, data: str | dict):
         self.name = self.__class__.__name__
         self.data = data
         if type(self.data) != dict:
-            self.patterns = patterns
-            self.format_functions = format_functions
             self.data = self.extract_data(self.data)
             self.data = self.format(self.data)
 
-    def format(self, data: dict) -> dict:
-        # print(data) # Debug
+    @staticmethod
+    def classify(text: str) -> type:
+        """
+        Return the first registered issuer whose anchor occurs in the text,
+        or Fallback.
+        """
+        for issuer in ISSUERS:
+            if issuer.anchor in text:
+                return issuer
+        return Fallback
+
+    @classmethod
+    def format(cls, data: dict) -> dict:
         for key, value in data.items():
-            if key in self.format_functions:
-                data[key] = self.format_functions[key](value)
+            if key in cls.format_functions:
+                data[key] = cls.format_functions[key](value)
         return data
 
-    def extract_data(self, text: str) -> dict:
-        data = {}
-        for key, pattern in self.patterns.items():
+    @classmethod
+    def extract_data(cls, text: str, data: dict | None = None) -> dict:
+        """
+        Fill in the first match of every field still missing from data.
+        """
+        data = {} if data is None else data
+        for key, pattern in cls.compiled.items():
+            if key in data:
+                continue
             match = pattern.search(text)
             if match:
                 data[key] = match.group(0)
         return data
 
 class AmericanExpress(Issuer):
-    def __init__(self, text: str):
-        self.patterns = {
-            'amount': re.compile(r'Fakturans\s+saldo\s+(\d{1,3}(?:\.\d{3})*,\d{2})'),
-            'bankgiro': re.compile(r'Bankgiro:\s*(\d{4}-\d{4})'),
-            'ocr': re.compile(r'OCR:\s*(\d{10,20})'),
-            'due_date': re.compile(r'oss\stillhanda\sden\s(\d{2}\.\d{2}\.\d{2})'),
-        }
+    anchor = 'www.americanexpress.se'
 
-        self.format_functions = {
-            'bankgiro': lambda data: data.lower().replace('bankgiro:', '').strip(),
-            'ocr': lambda data: int(data.replace('OCR: ', '').replace(' ', '')),
-            'amount': lambda data: float(data.replace('Fakturans saldo', '').strip().replace('.', '').replace(',', '.')),
-            'due_date': lambda data: datetime.datetime.strptime(data.replace('oss tillhanda den', '').strip(), '%d.%m.%y')
-        }
+    patterns = {
+        'amount': r'Fakturans\s+saldo\s+(\d{1,3}(?:\.\d{3})*,\d{2})',
+        'bankgiro': r'Bankgiro:\s*(\d{4}-\d{4})',
+        'ocr': r'OCR:\s*(\d{10,20})',
+        'due_date': r'oss\stillhanda\sden\s(\d{2}\.\d{2}\.\d{2})',
+    }
 
-        super().__init__(self.patterns, self.format_functions, text)
+    format_functions = {
+        'bankgiro': lambda data: data.lower().replace('bankgiro:', '').strip(),
+        'ocr': lambda data: int(data.replace('OCR: ', '').replace(' ', '')),
+        'amount': lambda data: float(data.replace('Fakturans saldo', '').strip().replace('.', '').replace(',', '.')),
+        'due_date': lambda data: datetime.datetime.strptime(data.replace('oss tillhanda den', '').strip(), '%d.%m.%y')
+    }
 
 class Lansforsakringar(Issuer):
-    def __init__(self, text: str):
-        self.patterns = {
-            'amount': re.compile(r'Summa\satt\sbetala\s(\d{1,3}(?:\s?\d{3})*)'),
-            'bankgiro': re.compile(r'(\d{3}-\d{4})\sLänsförsäkringar'),
-            'ocr': re.compile(r'OCR-nummer\s+(\d{10,20})'),
-            'due_date': re.compile(r'senast\s(\d{4}-\d{2}-\d{2})'),
-        }
+    anchor = 'Länsförsäkringar'
 
-        self.format_functions = {
-            'bankgiro': lambda data: data.replace('Länsförsäkringar', '').strip(),
-            'ocr': lambda data: int(data.replace('OCR-nummer', '').strip()),
-            'amount': lambda data: float(data.replace('Summa att betala', '').replace(' ', '').strip().replace('.', '').replace(',', '.')),
-            'due_date': lambda data: datetime.datetime.strptime(data.replace('senast', '').strip(), '%Y-%m-%d')
-        }
+    patterns = {
+        'amount': r'Summa\satt\sbetala\s(\d{1,3}(?:\s?\d{3})*)',
+        'bankgiro': r'(\d{3}-\d{4})\sLänsförsäkringar',
+        'ocr': r'OCR-nummer\s+(\d{10,20})',
+        'due_date': r'senast\s(\d{4}-\d{2}-\d{2})',
+    }
 
-        super().__init__(self.patterns, self.format_functions, text)
+    format_functions = {
+        'bankgiro': lambda data: data.replace('Länsförsäkringar', '').strip(),
+        'ocr': lambda data: int(data.replace('OCR-nummer', '').strip()),
+        'amount': lambda data: float(data.replace('Summa att betala', '').replace(' ', '').strip().replace('.', '').replace(',', '.')),
+        'due_date': lambda data: datetime.datetime.strptime(data.replace('senast', '').strip(), '%Y-%m-%d')
+    }
 
 class Transportstyrelsen(Issuer):
-    def __init__(self, text: str):
-        self.patterns = {
-            'amount': re.compile(r'Summa\satt\sbetala\s(\d+)'),
-            'bankgiro': re.compile(r'(\d{3}-\d{4})\swww\.transportstyrelsen\.se'),
-            'ocr': re.compile(r'OCR-nummer\s+(\d{10,20})'),
-            'due_date': re.compile(r'senast\s(\d{4}-\d{2}-\d{2})'),
-        }
+    anchor = 'Transportstyrelsen'
 
-        self.format_functions = {
-            'bankgiro': lambda data: data.replace('www.transportstyrelsen.se', '').strip(),
-            'ocr': lambda data: int(data.replace('OCR-nummer', '').strip()),
-            'amount': lambda data: float(data.replace('Summa att betala', '').strip()),
-            'due_date': lambda data: datetime.datetime.strptime(data.replace('senast', '').strip(), '%Y-%m-%d')
-        }
+    patterns = {
+        'amount': r'Summa\satt\sbetala\s(\d+)',
+        'bankgiro': r'(\d{3}-\d{4})\swww\.transportstyrelsen\.se',
+        'ocr': r'OCR-nummer\s+(\d{10,20})',
+        'due_date': r'senast\s(\d{4}-\d{2}-\d{2})',
+    }
 
-        super().__init__(self.patterns, self.format_functions, text)
+    format_functions = {
+        'bankgiro': lambda data: data.replace('www.transportstyrelsen.se', '').strip(),
+        'ocr': lambda data: int(data.replace('OCR-nummer', '').strip()),
+        'amount': lambda data: float(data.replace('Summa att betala', '').strip()),
+        'due_date': lambda data: datetime.datetime.strptime(data.replace('senast', '').strip(), '%Y-%m-%d')
+    }
 
 class Telenor(Issuer):
-    def __init__(self, text: str):
-        self.patterns = {
-            'amount': re.compile(r'Summa\satt\sbetala\s(\d{1,3}(?:\.\d{3})*,\d{2})'),
-            'bankgiro': re.compile(r'(\d{4}-\d{4})\sTelenor\sSverige\sAB'),
-            'ocr': re.compile(r'OCR-nummer:\s*#\s*(\d{10,20})'),
-            'due_date': re.compile(r'oss\stillhanda\s(\d{1,2})\s([a-zA-Z]+)\s(\d{4})'),
-        }
+    anchor = 'Telenor'
 
-        self.format_functions = {
-            'bankgiro': lambda data: data.replace('Telenor Sverige AB', '').strip(),
-            'ocr': lambda data: int(data.replace('OCR-nummer:', '').replace('#', '').strip()),
-            'amount': lambda data: float(data.replace('Summa att betala', '').replace(',', '.').strip()),
-            'due_date': lambda data: datetime.datetime.strptime(data.replace('oss tillhanda', '').replace(data.split()[3], str(MONTH_MAP[data.split()[3]])).strip().replace(' ', '-'), '%d-%m-%Y')
-        }
+    patterns = {
+        'amount': r'Summa\satt\sbetala\s(\d{1,3}(?:\.\d{3})*,\d{2})',
+        'bankgiro': r'(\d{4}-\d{4})\sTelenor\sSverige\sAB',
+        'ocr': r'OCR-nummer:\s*#\s*(\d{10,20})',
+        'due_date': r'oss\stillhanda\s(\d{1,2})\s([a-zA-Z]+)\s(\d{4})',
+    }
 
-        super().__init__(self.patterns, self.format_functions, text)
+    format_functions = {
+        'bankgiro': lambda data: data.replace('Telenor Sverige AB', '').strip(),
+        'ocr': lambda data: int(data.replace('OCR-nummer:', '').replace('#', '').strip()),
+        'amount': lambda data: float(data.replace('Summa att betala', '').strip().replace('.', '').replace(',', '.')),
+        'due_date': lambda data: datetime.datetime.strptime(data.replace('oss tillhanda', '').replace(data.split()[3], str(MONTH_MAP[data.split()[3]])).strip().replace(' ', '-'), '%d-%m-%Y')
+    }
 
 class Fallback(Issuer):
-    def __init__(self, text: str):
-        self.patterns = {
-            'ocr': re.compile(r'#\s*(\d{10,20})\s+#'),
-            'amount': re.compile(r'#\s*(\d{1,3}\s+\d{2})\s'),
-            'bankgiro': re.compile(r'>\s*(\d{7}|\d{3}-\d{4})')
-        }
+    patterns = {
+        'ocr': r'#\s*(\d{10,20})\s+#',
+        'amount': r'#\s*(\d{1,3}\s+\d{2})\s',
+        'bankgiro': r'>\s*(\d{7}|\d{3}-\d{4})'
+    }
 
-        self.format_functions = {
-            'amount': lambda data: float('.'.join((data.replace('#', '').strip().split(' ')[:2]))) if data else None,
-            'ocr': lambda data: int(data.replace('#', '').strip()) if data else None,
-            'bankgiro': lambda data: data.replace('>', '').strip()[:3] + '-' + data.replace('>', '').strip()[3:] if data else None,
-        }
+    format_functions = {
+        'amount': lambda data: float('.'.join((data.replace('#', '').strip().split(' ')[:2]))) if data else None,
+        'ocr': lambda data: int(data.replace('#', '').strip()) if data else None,
+        'bankgiro': lambda data: data.replace('>', '').strip()[:3] + '-' + data.replace('>', '').strip()[3:] if data else None,
+    }
 
-        super().__init__(self.patterns, self.format_functions, text)
+def parse_qr_payload(raw: bytes) -> dict | None:
+    """
+    Parse a decoded QR payload, returning None unless it is a payment dict.
+    """
+    text = raw.decode('utf-8', errors='replace')
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            payload = parse(text)
+        except (ValueError, SyntaxError):
+            continue
+        if isinstance(payload, dict):
+            return payload
+    return None
 
 class QRCodeExtractor:
-    def __init__(self, pdf_path):
+    """
+    Find Swedish payment QR codes in a PDF, cheapest strategy first.
+
+    Tiers are tried in order and extraction stops at the first payload:
+      image    - images embedded in each page
+      low_zoom - low-resolution renders of the likely pages (first and last)
+      crop     - high-resolution renders of CROP_REGIONS on the likely pages
+      full     - full FULL_ZOOM renders of every page
+    Each image is decoded as-is before falling back to preprocess_image.
+    """
+
+    TIERS = ('image', 'low_zoom', 'crop', 'full')
+    LOW_ZOOM = 1.5
+    FULL_ZOOM = 3
+    # Fractions of the page (x0, y0, x1, y1) where the payment QR usually sits
+    CROP_REGIONS = {
+        'payment_slip': (0, 0.6, 1, 1),
+        'top_right': (0.5, 0, 1, 0.35),
+    }
+
+    # The NumPy path downscales by the largest integer factor that keeps the
+    # long side at least this long: a FULL_ZOOM A4 render (about 2500 px)
+    # halves to about 1260 px, which still gives a 3 cm payment QR code over
+    # 3 px per module. The render itself is always decoded at full size first.
+    NUMPY_MIN_SIDE = 1200
+
+    tier_stats = {tier: {'attempts': 0, 'hits': 0} for tier in TIERS}
+    _stats_lock = threading.Lock()
+
+    def __init__(self, pdf_path, extract=True, preprocess='pil'):
         self.pdf_path = pdf_path
+        self.preprocess = preprocess
         self.qr_data_list = []
-        self.extract_qr_code()
+        if extract:
+            self.extract_qr_code()
 
     def extract_qr_code(self):
-        images = self.extract_images_from_pdf(self.pdf_path)
-        self.qr_data_list = self.decode_qr_from_images(images)
-        if not self.qr_data_list:
-            # Try rendering pages if no QR code found in images
-            self.qr_data_list = self.decode_qr_from_pdf_pages(self.pdf_path)
+        with fitz.open(self.pdf_path) as pdf_file:
+            for tier in self.TIERS:
+                for unit in self.tier_units(tier, len(pdf_file)):
+                    self.qr_data_list = self.scan_unit(pdf_file, tier, *unit)
+                    if self.qr_data_list:
+                        break
+                self.record_tier(tier, hit=bool(self.qr_data_list))
+                if self.qr_data_list:
+                    return
+
+    @classmethod
+    def record_tier(cls, tier, hit):
+        with cls._stats_lock:
+            cls.tier_stats[tier]['attempts'] += 1
+            cls.tier_stats[tier]['hits'] += int(hit)
+
+    @classmethod
+    def get_tier_stats(cls) -> dict:
+        """Return per-tier attempt and hit counts with their hit rate."""
+        with cls._stats_lock:
+            return {
+                tier: {**stats, 'hit_rate': stats['hits'] / stats['attempts'] if stats['attempts'] else None}
+                for tier, stats in cls.tier_stats.items()
+            }
+
+    def likely_pages(self, page_count):
+        return sorted({0, page_count - 1}) if page_count else []
 
-    def extract_images_from_pdf(self, pdf_path):
+    def tier_units(self, tier, page_count) -> list:
+        """Return the (page_index, region) units of work for a tier."""
+        if tier == 'image' or tier == 'full':
+            return [(page_index, None) for page_index in range(page_count)]
+        if tier == 'low_zoom':
+            return [(page_index, None) for page_index in self.likely_pages(page_count)]
+        if tier == 'crop':
+            return [(page_index, region) for page_index in self.likely_pages(page_count) for region in self.CROP_REGIONS]
+        raise ValueError(f"Unknown tier: {tier}")
+
+    def scan_unit(self, pdf_file, tier, page_index, region=None, cancelled=lambda: False):
+        """
+        Decode the QR payloads in one unit of a tier. Returns an empty list
+        if nothing is found or cancelled() turns True between images.
+        """
+        if tier == 'image':
+            images = self.extract_images_from_page(pdf_file, page_index)
+        elif tier == 'low_zoom':
+            images = [self.render_page(pdf_file[page_index], zoom=self.LOW_ZOOM)]
+        elif tier == 'crop':
+            images = [self.render_page(pdf_file[page_index], zoom=self.FULL_ZOOM, region=self.CROP_REGIONS[region])]
+        else:
+            images = [self.render_page(pdf_file[page_index], zoom=self.FULL_ZOOM)]
+
+        for img in images:
+            if cancelled():
+                return []
+            qr_data_list = self.decode_qr(img)
+            if qr_data_list:
+                return qr_data_list
+        return []
+
+    def extract_images_from_page(self, pdf_file, page_index):
         images = []
-        pdf_file = fitz.open(pdf_path)
-        for page_index in range(len(pdf_file)):
-            page = pdf_file[page_index]
-            image_list = page.get_images(full=True)
-            for img_index, img in enumerate(image_list, start=1):
-                xref = img[0]
-                base_image = pdf_file.extract_image(xref)
-                image_bytes = base_image["image"]
-                image = Image.open(io.BytesIO(image_bytes))
-                images.append(image)
+        page = pdf_file[page_index]
+        for img in page.get_images(full=True):
+            xref = img[0]
+            base_image = pdf_file.extract_image(xref)
+            image_bytes = base_image["image"]
+            images.append(Image.open(io.BytesIO(image_bytes)))
         return images
 
-    def preprocess_image(self, img):
+    def render_page(self, page, zoom=3, region=None):
+        mat = fitz.Matrix(zoom, zoom)
+        clip = None
+        if region:
+            x0, y0, x1, y1 = region
+            rect = page.rect
+            clip = fitz.Rect(rect.x0 + x0 * rect.width, rect.y0 + y0 * rect.height,
+                             rect.x0 + x1 * rect.width, rect.y0 + y1 * rect.height)
+        pix = page.get_pixmap(matrix=mat, clip=clip)
+        return Image.open(io.BytesIO(pix.tobytes()))
+
+    def preprocess_image(self, img, method=None):
+        """
+        Binarize an image for QR decoding with the given method ('pil' or
+        'numpy'), defaulting to the extractor's preprocess setting.
+        """
+        method = method or self.preprocess
+        if method == 'numpy':
+            return self.preprocess_image_numpy(img)
+        if method != 'pil':
+            raise ValueError(f"Unknown preprocessing method: {method}")
+
         # Grayscale conversion
         img_gray = img.convert('L')
         # Contrast enhancement
@@ -216,29 +434,103 @@ class QRCodeExtractor:
         img_filtered = img_binarized.filter(ImageFilter.MedianFilter(size=3))
         return img_filtered
 
-    def decode_qr_from_images(self, images):
-        qr_data_list = []
-        for img in images:
-            img_preprocessed = self.preprocess_image(img)
-            decoded_objects = decode(img_preprocessed)
-            for obj in decoded_objects:
-                if obj.type == 'QRCODE':
-                    qr_data = obj.data.decode('utf-8')
-                    qr_data_list.append(eval(qr_data))
-        return qr_data_list if qr_data_list else None
-
-    def decode_qr_from_pdf_pages(self, pdf_path):
-        pdf_file = fitz.open(pdf_path)
+    def preprocess_image_numpy(self, img, threshold='otsu'):
+        """
+        Array version of the PIL chain, run on a buffer downscaled towards
+        NUMPY_MIN_SIDE pixels: grayscale, percentile contrast stretch, Otsu or
+        adaptive threshold, and a 3x3 majority filter (the median of a binary
+        image). Returns a uint8 array, which pyzbar decodes directly.
+        """
+        if img.mode in ('L', 'RGB', 'RGBA'):
+            arr = np.asarray(img)
+        else:
+            # Palette, CMYK and other modes are rare here; let PIL map them
+            arr = np.asarray(img.convert('L'))
+
+        if arr.ndim == 3:
+            # ITU-R 601-2 luma, as used by PIL's convert('L'); alpha is ignored
+            arr = arr[..., :3] @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        else:
+            arr = arr.astype(np.float32)
+
+        # Area-average downscale by an integer factor. Summing strided views
+        # is several times faster than a reshape and mean over the uint8 buffer.
+        factor = max(max(arr.shape) // self.NUMPY_MIN_SIDE, 1)
+        if factor > 1:
+            h, w = arr.shape[0] // factor * factor, arr.shape[1] // factor * factor
+            arr = sum(arr[i:h:factor, j:w:factor] for i in range(factor) for j in range(factor)) / (factor * factor)
+
+        # Contrast stretch between the 2nd and 98th percentile
+        low, high = np.percentile(arr, (2, 98))
+        if high > low:
+            arr = np.clip((arr - low) * (255.0 / (high - low)), 0, 255)
+
+        if threshold == 'adaptive':
+            binary = arr > self._local_mean(arr, 15) - 10
+        else:
+            binary = arr > self._otsu_threshold(arr)
+
+        # 3x3 majority filter
+        denoised = self._box_sum(binary.astype(np.uint8), 3) >= 5
+        return denoised.astype(np.uint8) * 255
+
+    @staticmethod
+    def _otsu_threshold(arr):
+        hist = np.bincount(arr.astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+        if np.count_nonzero(hist) < 2:
+            # A uniform image (blank page or margin) has nothing to separate
+            return 127
+        levels = np.arange(256)
+        weight_bg = np.cumsum(hist)
+        weight_fg = weight_bg[-1] - weight_bg
+        sum_bg = np.cumsum(hist * levels)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_bg = sum_bg / weight_bg
+            mean_fg = (sum_bg[-1] - sum_bg) / weight_fg
+            variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        return int(np.nanargmax(variance))
+
+    @staticmethod
+    def _box_sum(arr, size):
+        """Sum over a size x size window around each pixel, edges padded."""
+        pad = size // 2
+        integral = np.pad(arr, pad, mode='edge').astype(np.float64).cumsum(0).cumsum(1)
+        integral = np.pad(integral, ((1, 0), (1, 0)))
+        return (integral[size:, size:] - integral[:-size, size:]
+                - integral[size:, :-size] + integral[:-size, :-size])
+
+    @classmethod
+    def _local_mean(cls, arr, size):
+        return cls._box_sum(arr, size) / (size * size)
+
+    def decode_qr(self, img, method=None):
+        """Decode the image as-is, and only preprocess it if that fails."""
+        qr_data_list = self.decode_payloads(img)
+        if not qr_data_list:
+            qr_data_list = self.decode_payloads(self.preprocess_image(img, method))
+        return qr_data_list
+
+    def decode_payloads(self, img):
         qr_data_list = []
-        for page_index in range(len(pdf_file)):
-            page = pdf_file[page_index]
-            zoom = 3  # Increase zoom factor
-            mat = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=mat)
-            img = Image.open(io.BytesIO(pix.tobytes()))
-            img_preprocessed = self.preprocess_image(img)
-            decoded_objects = decode(img_preprocessed)
-            for obj in decoded_objects:
-                if obj.type == 'QRCODE':
-                    qr_data = obj.data.decode('utf-8')
-        return qr_data_list if qr_data_list else None
\ No newline at end of file
+        for obj in decode(img):
+            if obj.type == 'QRCODE':
+                payload = parse_qr_payload(obj.data)
+                if payload is not None:
+                    qr_data_list.append(payload)
+        return qr_data_list
+
+
+if __name__ == '__main__':
+    import sys
+    import timeit
+
+    # Benchmark the preprocessing methods on full-zoom renders of a PDF:
+    #   python services/invoice.py invoice.pdf
+    extractor = QRCodeExtractor(sys.argv[1], extract=False)
+    with fitz.open(sys.argv[1]) as pdf_file:
+        renders = [extractor.render_page(page, zoom=QRCodeExtractor.FULL_ZOOM) for page in pdf_file]
+
+    for method in ('pil', 'numpy'):
+        seconds = timeit.timeit(lambda: [extractor.preprocess_image(img, method) for img in renders], number=5) / 5
+        found = sum(bool(extractor.decode_payloads(extractor.preprocess_image(img, method))) for img in renders)
+        print(f"{method:>5}: {seconds / len(renders) * 1000:.1f} ms/page, QR found on {found}/{len(renders)} pages")
@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+import traceback
+
+
+class JobQueue:
+    """Run functions on a background thread pool inside the Flask app context."""
+
+    def __init__(self, workers: int = 4):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='jobs')
+
+    def submit(self, func, *args, app=None, **kwargs):
+        """
+        Queue func(*args, **kwargs). The app defaults to the current one, so
+        this must be called from a request or app context unless app is given.
+        """
+        app = app or current_app._get_current_object()
+        return self.executor.submit(self._run, app, func, args, kwargs)
+
+    def _run(self, app, func, args, kwargs):
+        with app.app_context():
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                print(f"Background job {func.__name__} failed:")
+                traceback.print_exc()
+                raise
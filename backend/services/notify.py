@@ -1,22 +1,216 @@
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+import threading
+import sqlite3
+import queue
+import time
 import os
 
 load_dotenv()
 
+# Discord rejects messages with more content than this
+MAX_MESSAGE_LENGTH = 2000
+
+# Outcomes of a delivery
+SENT, RETRY, REJECTED = 'sent', 'retry', 'rejected'
+
+def split_message(lines, limit=MAX_MESSAGE_LENGTH, separator='\n'):
+    """Join lines into as few messages as fit within limit, splitting only between lines."""
+    messages, current = [], ''
+    for line in lines:
+        line = line[:limit]
+        if current and len(current) + len(separator) + len(line) > limit:
+            messages.append(current)
+            current = ''
+        current = f'{current}{separator}{line}' if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
+class Outbox:
+    """
+    Messages waiting for delivery, kept in a small SQLite file so they
+    survive restarts. A message that has failed max_attempts times stays in
+    the table as a dead letter and is no longer returned by pending().
+    """
+
+    def __init__(self, path: str, max_attempts: int):
+        self.path = os.path.abspath(path)
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY, content TEXT NOT NULL, '
+                'attempts INTEGER NOT NULL DEFAULT 0, created_at TEXT DEFAULT CURRENT_TIMESTAMP)'
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def add(self, content: str) -> int:
+        with self._lock, self._connect() as connection:
+            return connection.execute('INSERT INTO outbox (content) VALUES (?)', (content,)).lastrowid
+
+    def pending(self):
+        with self._lock, self._connect() as connection:
+            return connection.execute(
+                'SELECT id, content FROM outbox WHERE attempts < ? ORDER BY id', (self.max_attempts,)
+            ).fetchall()
+
+    def delete(self, ids):
+        with self._lock, self._connect() as connection:
+            connection.executemany('DELETE FROM outbox WHERE id = ?', [(message_id,) for message_id in ids])
+
+    def record_attempt(self, ids, final=False):
+        """Count a failed delivery, or use up every attempt if final. Returns the ids now dead."""
+        attempts = 'attempts + 1' if not final else '?'
+        params = [(message_id,) if not final else (self.max_attempts, message_id) for message_id in ids]
+        with self._lock, self._connect() as connection:
+            connection.executemany(f'UPDATE outbox SET attempts = {attempts} WHERE id = ?', params)
+            placeholders = ', '.join('?' * len(ids))
+            return [row[0] for row in connection.execute(
+                f'SELECT id FROM outbox WHERE id IN ({placeholders}) AND attempts >= ?', (*ids, self.max_attempts)
+            )]
+
+
+class NotificationDispatcher:
+    """
+    Deliver Discord webhook messages from a background worker.
+
+    send() stores the message in the outbox and returns at once. The worker
+    waits coalesce_window seconds for more messages, joins them into as few
+    webhook calls as fit Discord's size limit, and posts them over one pooled
+    session. Rate limits (429 with Retry-After, or an exhausted
+    X-RateLimit-Remaining) are waited out; other failures are retried with
+    exponential backoff. Messages leave the outbox only once delivered, and
+    anything left over is retried every retry_interval seconds and after a
+    restart, up to max_attempts times. A message Discord rejects outright
+    (another 4xx) is not retried.
+    """
+
+    MAX_BACKOFF = 60
+
+    def __init__(self, webhook_url: str | None, outbox_path: str, coalesce_window: float = 1.0,
+                 max_attempts: int = 5, retry_interval: float = 300):
+        self.webhook_url = webhook_url
+        self.outbox_path = outbox_path
+        self.coalesce_window = coalesce_window
+        self.max_attempts = max_attempts
+        self.retry_interval = retry_interval
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.outbox = None
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Open the outbox and start the worker, which first resends anything left undelivered."""
+        with self._start_lock:
+            if self._thread:
+                return
+            self.outbox = Outbox(self.outbox_path, self.max_attempts)
+            for message_id, content in self.outbox.pending():
+                self._enqueue(message_id, content)
+            self._thread = threading.Thread(target=self._loop, daemon=True, name='notifications')
+            self._thread.start()
+
+    def send(self, message: str):
+        self.start()
+        self._enqueue(self.outbox.add(message), message)
+
+    def _enqueue(self, message_id, content):
+        with self._lock:
+            if message_id in self._queued:
+                return
+            self._queued.add(message_id)
+        self._queue.put((message_id, content))
+
+    def _loop(self):
+        next_retry = time.monotonic() + self.retry_interval
+        while True:
+            # Pick up messages that failed earlier, even while new ones keep coming
+            if time.monotonic() >= next_retry:
+                for message_id, content in self.outbox.pending():
+                    self._enqueue(message_id, content)
+                next_retry = time.monotonic() + self.retry_interval
+            try:
+                batch = [self._queue.get(timeout=max(next_retry - time.monotonic(), 0))]
+            except queue.Empty:
+                continue
+
+            # Coalesce a burst of messages into as few webhook calls as possible
+            deadline = time.monotonic() + self.coalesce_window
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            if not self.webhook_url:
+                print("DISCORD_WEBHOOK is not set, keeping the messages in the outbox")
+            else:
+                for ids, content in self._combine(batch):
+                    result = self._deliver(content)
+                    if result == SENT:
+                        self.outbox.delete(ids)
+                        continue
+                    for message_id in self.outbox.record_attempt(ids, final=result == REJECTED):
+                        print(f"Giving up on notification {message_id}; it stays in the outbox as a dead letter")
+            with self._lock:
+                self._queued.difference_update(message_id for message_id, _ in batch)
+
+    def _combine(self, batch):
+        """Group (id, content) pairs into ([ids], content) messages within the size limit."""
+        groups, ids, parts = [], [], []
+        for message_id, content in batch:
+            if parts and len(split_message(parts + [content], separator='\n\n')) > 1:
+                groups.append((ids, '\n\n'.join(parts)))
+                ids, parts = [], []
+            ids.append(message_id)
+            parts.append(content[:MAX_MESSAGE_LENGTH])
+        if parts:
+            groups.append((ids, '\n\n'.join(parts)))
+        return groups
+
+    def _deliver(self, content) -> str:
+        """Post one message; returns SENT, RETRY or REJECTED."""
+        backoff = 1
+        for attempt in range(self.max_attempts):
+            try:
+                response = self.session.post(self.webhook_url, json={'content': content}, timeout=10)
+            except requests.RequestException as e:
+                print(f"Failed to send message: {e}")
+            else:
+                if response.ok:
+                    # Wait out the bucket before the next call instead of hitting a 429
+                    if response.headers.get('X-RateLimit-Remaining') == '0':
+                        time.sleep(float(response.headers.get('X-RateLimit-Reset-After', 1)))
+                    return SENT
+                if response.status_code == 429:
+                    retry_after = response.headers.get('Retry-After', backoff)
+                    print(f"Rate limited by Discord, retrying in {retry_after}s")
+                    time.sleep(float(retry_after))
+                    continue
+                print(f"Failed to send message: {response.status_code}, {response.text}")
+                if response.status_code < 500:
+                    return REJECTED
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.MAX_BACKOFF)
+        return RETRY
+
+
+dispatcher = NotificationDispatcher(
+    os.getenv('DISCORD_WEBHOOK'),
+    os.getenv('NOTIFY_OUTBOX_PATH', 'instance/notify_outbox.sqlite3'),
+    coalesce_window=float(os.getenv('NOTIFY_COALESCE_SECONDS', 1.0))
+)
 
 def send_discord_notification(message):
-    """Send a notification to the Discord channel via webhook."""
-    data = {
-        "content": message,
-    }
-    headers = {
-        "Content-Type": "application/json"
-    }
-
-    response = requests.post(os.getenv('DISCORD_WEBHOOK'), json=data, headers=headers)
-
-    if response.status_code == 204:
-        print("Message sent successfully!")
-    else:
-        print(f"Failed to send message: {response.status_code}, {response.text}")
\ No newline at end of file
+    """Queue a notification for the Discord channel; delivery happens in the background."""
+    dispatcher.send(message)
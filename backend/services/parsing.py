@@ -0,0 +1,145 @@
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import fitz
+from services.invoice import InvoiceReader, QRCodeExtractor, TextReader
+
+
+def scan_unit(pdf_path: str, tier: str, page_index: int, region: str | None, preprocess: str, cancel_event) -> list:
+    """Worker task: return the QR payloads found in one unit of a QR tier."""
+    if cancel_event.is_set():
+        return []
+    extractor = QRCodeExtractor(pdf_path, extract=False, preprocess=preprocess)
+    with fitz.open(pdf_path) as pdf_file:
+        return extractor.scan_unit(pdf_file, tier, page_index, region, cancel_event.is_set)
+
+
+def read_text(pdf_path: str):
+    """Worker task: read the issuer fields from the document text."""
+    return TextReader(pdf_path).read()
+
+
+class ParsingEngine:
+    """
+    Parse invoices with their pages fanned out over a pool of worker processes.
+
+    `read` is a drop-in replacement for `InvoiceReader.read`: it returns the
+    same `Issuer`, but each QRCodeExtractor tier is scanned with its pages in
+    parallel, and the remaining work is cancelled as soon as one unit yields
+    a payload. Without a QR code, the TextReader runs on a worker.
+    Raises TimeoutError if a document takes longer than `timeout` seconds.
+    A timeout or a crashed worker discards the pool, terminating its
+    processes, so the next call starts a fresh one instead of waiting on a
+    hung worker or failing with BrokenProcessPool.
+    """
+
+    def __init__(self, workers: int | None = None, timeout: float | None = None, preprocess: str = 'pil'):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.preprocess = preprocess
+        self._pool = None
+        self._manager = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        return self._acquire()[0]
+
+    def _acquire(self):
+        """Return (pool, manager), starting them if needed."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._manager = multiprocessing.Manager()
+            return self._pool, self._manager
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._manager.shutdown()
+                self._pool = None
+                self._manager = None
+
+    def _discard(self, pool):
+        """Drop a broken or hung pool, unless another call already replaced it."""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            manager = self._manager
+            self._pool = None
+            self._manager = None
+        # shutdown() does not stop a worker stuck in a task, so terminate them
+        processes = list((pool._processes or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+        manager.shutdown()
+
+    def read(self, filename: str):
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+
+        with fitz.open(filename) as pdf_file:
+            page_count = len(pdf_file)
+
+        qr = self.find_qr(filename, page_count, deadline)
+        if qr is not None:
+            return InvoiceReader(filename, InvoiceReader.from_qr(qr)).identify_issuer()
+
+        return self.read_text(filename, deadline)
+
+    def find_qr(self, filename: str, page_count: int, deadline: float | None) -> dict | None:
+        extractor = QRCodeExtractor(filename, extract=False)
+        for tier in QRCodeExtractor.TIERS:
+            qr = self.scan_tier(filename, tier, extractor.tier_units(tier, page_count), deadline)
+            QRCodeExtractor.record_tier(tier, hit=qr is not None)
+            if qr is not None:
+                return qr
+        return None
+
+    def scan_tier(self, filename: str, tier: str, units: list, deadline: float | None) -> dict | None:
+        pool, manager = self._acquire()
+        futures = []
+        try:
+            cancel_event = manager.Event()
+            futures = [pool.submit(scan_unit, filename, tier, page_index, region, self.preprocess, cancel_event)
+                       for page_index, region in units]
+            for future in as_completed(futures, timeout=self._remaining(deadline)):
+                qr_data_list = future.result()
+                if qr_data_list:
+                    return qr_data_list[0]
+        except FuturesTimeoutError:
+            self._discard(pool)
+            raise TimeoutError(f'Parsing {filename} exceeded {self.timeout}s')
+        except BrokenProcessPool:
+            self._discard(pool)
+            raise
+        finally:
+            for future in futures:
+                future.cancel()
+            if futures:
+                try:
+                    cancel_event.set()
+                except (OSError, EOFError):
+                    pass  # the manager went away with a discarded pool
+        return None
+
+    def read_text(self, filename: str, deadline: float | None):
+        pool = self.pool
+        try:
+            return pool.submit(read_text, filename).result(timeout=self._remaining(deadline))
+        except FuturesTimeoutError:
+            self._discard(pool)
+            raise TimeoutError(f'Parsing {filename} exceeded {self.timeout}s')
+        except BrokenProcessPool:
+            self._discard(pool)
+            raise
+
+    def _remaining(self, deadline: float | None) -> float | None:
+        if deadline is None:
+            return None
+        return max(deadline - time.monotonic(), 0)
@@ -0,0 +1,98 @@
+import os
+import glob
+import tempfile
+import threading
+import fitz
+
+
+class PreviewCache:
+    """
+    Render PDF pages to PNG previews and keep them in a size-capped disk cache.
+
+    Previews are stored as <key>_<page>_<width>.png, where key identifies the
+    document content (the upload's hash). Serving a preview touches its mtime,
+    and the least recently used files are evicted once the cache grows past
+    max_bytes. Requested widths are rounded up to one of WIDTHS so a handful
+    of sizes per page is ever rendered.
+    """
+
+    WIDTHS = (160, 320, 640, 1280)
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def snap_width(self, width: int) -> int:
+        for size in self.WIDTHS:
+            if width <= size:
+                return size
+        return self.WIDTHS[-1]
+
+    def path(self, key: str, page: int, width: int) -> str:
+        return os.path.join(self.directory, f'{key}_{page}_{width}.png')
+
+    def get(self, pdf_path: str, key: str, page: int = 0, width: int = 320) -> str | None:
+        """
+        Return the path of a cached preview, rendering it on a miss.
+        Returns None if the page does not exist.
+        """
+        width = self.snap_width(width)
+        path = self.path(key, page, width)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+
+        if not self.render(pdf_path, path, page, width):
+            return None
+        self.evict()
+        return path
+
+    def render(self, pdf_path: str, path: str, page: int, width: int) -> bool:
+        with fitz.open(pdf_path) as pdf_file:
+            if not 0 <= page < len(pdf_file):
+                return False
+            pdf_page = pdf_file[page]
+            zoom = width / pdf_page.rect.width
+            pix = pdf_page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+
+        # Write to a temp file first so readers never see a partial image
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(pix.tobytes('png'))
+        os.replace(tmp_path, path)
+        return True
+
+    def pregenerate(self, pdf_path: str, key: str, pages=(0,), widths=(320, 640)):
+        for page in pages:
+            for width in widths:
+                if self.get(pdf_path, key, page, width) is None:
+                    break
+
+    def discard(self, key: str):
+        for path in glob.glob(os.path.join(self.directory, f'{glob.escape(key)}_*.png')):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.png'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -1,37 +1,76 @@
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
-from datetime import datetime, timedelta
-import time
-
-class ScheduledJob:
-    def __init__(self, func, args=None, date=None, hour=None, minute=None):
-        self.scheduler = BackgroundScheduler()
-        args = args if args is not None else []
-
-        if date:
-            self.scheduler.add_job(func, 'date', run_date=date, args=args)
-        elif hour is not None and minute is not None:
-            print(f"Scheduling job for {hour}:{minute}")
-            self.scheduler.add_job(func, 'cron', hour=hour, minute=minute, args=args)
-        else:
-            raise ValueError("Either date or hour and minute must be provided.")
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.triggers.cron import CronTrigger
+import traceback
+import os
+
+class Scheduler:
+    """
+    One application-wide APScheduler instance for the recurring jobs.
+
+    Jobs are stored in the app's database, so a run missed while the app
+    was down still happens on startup if it is within misfire_grace_time.
+    Piled-up runs are coalesced into one and a job never runs twice at
+    once. The store only holds job names; run_job looks the function up
+    in the registry and runs it inside the Flask app context.
+    """
+
+    def __init__(self, max_workers: int = 4, misfire_grace_time: int = 6 * 60 * 60):
+        self.max_workers = max_workers
+        self.misfire_grace_time = misfire_grace_time
+        self.jobs = {}
+        self.app = None
+        self.scheduler = None
+
+    def add(self, name, func, hour, minute):
+        """Register func to run every day at hour:minute."""
+        self.jobs[name] = (func, CronTrigger(hour=hour, minute=minute))
+
+    def start(self, app, engine):
+        if self.scheduler:
+            return
+        self.app = app
+        self.scheduler = BackgroundScheduler(
+            jobstores={'default': SQLAlchemyJobStore(engine=engine)},
+            executors={'default': ThreadPoolExecutor(self.max_workers)},
+            job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': self.misfire_grace_time},
+        )
         self.scheduler.start()
-        self.scheduler.add_listener(self.job_listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
 
-    def job_listener(self, event):
-        print("Job completed or errored. Shutting down scheduler.")
-        self.scheduler.shutdown(wait=False)
+        for job in self.scheduler.get_jobs():
+            if job.id not in self.jobs:
+                print(f"Removing job {job.id}, which is no longer registered")
+                job.remove()
+        for name, (func, trigger) in self.jobs.items():
+            job = self.scheduler.get_job(name)
+            # Keep a stored job as is, so its next run time survives restarts
+            if job is None or str(job.trigger) != str(trigger):
+                print(f"Scheduling {name}: {trigger}")
+                self.scheduler.add_job(run_job, trigger, args=[name], id=name, name=name, replace_existing=True)
 
-if __name__ == '__main__':
-    def print_time():
-        print(f"Time: {datetime.now()}")
+    def run(self, name):
+        func, _ = self.jobs[name]
+        with self.app.app_context():
+            try:
+                func()
+            except Exception:
+                print(f"Scheduled job {name} failed:")
+                traceback.print_exc()
 
-    def print_error():
-        print("Error occurred.")
+    def next_run_times(self):
+        if not self.scheduler:
+            return {}
+        return {
+            job.id: job.next_run_time.isoformat() if job.next_run_time else None
+            for job in self.scheduler.get_jobs()
+        }
 
-    job = ScheduledJob(print_time, hour=12, minute=32)
-    job_error = ScheduledJob(print_error, hour=12, minute=33)
+scheduler = Scheduler(
+    max_workers=int(os.getenv('SCHEDULER_WORKERS', 4)),
+    misfire_grace_time=int(os.getenv('SCHEDULER_MISFIRE_GRACE_SECONDS', 6 * 60 * 60))
+)
 
-    while True:
-        time.sleep(1)
-    print("Main thread finished.")
\ No newline at end of file
+def run_job(name):
+    """Entry point stored in the job store; it must stay importable by this name."""
+    scheduler.run(name)
@@ -0,0 +1,50 @@
+import threading
+import traceback
+from datetime import datetime
+
+
+class BackgroundSyncer:
+    """
+    Run a sync function on a background thread every interval seconds, or
+    sooner when triggered, inside the Flask app context. Only one run is
+    ever in progress; triggers during a run queue a single follow-up run.
+    """
+
+    def __init__(self, func, interval: float):
+        self.func = func
+        self.interval = interval
+        self.in_progress = False
+        self.last_result = None
+        self.last_error = None
+        self.last_finished_at = None
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, app, initial_delay: float = 0):
+        if self._thread:
+            return
+        self._thread = threading.Thread(
+            target=self._loop, args=(app, initial_delay), daemon=True, name=f'sync-{self.func.__name__}'
+        )
+        self._thread.start()
+
+    def trigger(self):
+        self._wake.set()
+
+    def _loop(self, app, delay):
+        while True:
+            self._wake.wait(timeout=max(delay, 0))
+            self._wake.clear()
+            self.in_progress = True
+            with app.app_context():
+                try:
+                    self.last_result = self.func()
+                    self.last_error = None
+                except Exception as e:
+                    print(f"Background sync {self.func.__name__} failed:")
+                    traceback.print_exc()
+                    self.last_error = str(e)
+                finally:
+                    self.in_progress = False
+                    self.last_finished_at = datetime.now()
+            delay = self.interval
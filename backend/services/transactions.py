@@ -1,44 +1,206 @@
 from nordigen import NordigenClient
+from nordigen.types.http_enums import HTTPMethod
+from requests.adapters import HTTPAdapter
+from requests.models import HTTPError
 # from uuid import uuid4
 from dotenv import load_dotenv
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import tempfile
+import requests
+import json
 import os
 
 load_dotenv()
 
-class TransactionService:
-    def __init__(self):
-        self.client = NordigenClient(
-            secret_id=os.getenv('NORDIGEN_SECRET_ID'),
-            secret_key=os.getenv('NORDIGEN_SECRET_KEY')
+class PooledNordigenClient(NordigenClient):
+    """NordigenClient that sends every request through one pooled requests.Session."""
+
+    def __init__(self, *args, pool_size: int = 10, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+
+    def request(self, method, endpoint, data=None, headers=None):
+        data = self.data_filter.filter_payload(data)
+        if method in (HTTPMethod.GET, HTTPMethod.DELETE):
+            body = {'params': data}
+        else:
+            body = {'data': json.dumps(data)}
+        response = self.session.request(
+            method.value, f"{self.base_url}/{endpoint}",
+            headers=headers or self._headers, timeout=self._timeout, **body
         )
+        if response.ok:
+            return response.json()
+        raise HTTPError({"response": response.json(), "status": response.status_code}, response=response)
+
+class TokenStore:
+    """
+    Persist the Nordigen access/refresh token pair with absolute expiry times,
+    so a restart reuses the tokens instead of generating new ones.
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save(self, tokens):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.part')
+        with os.fdopen(fd, 'w') as tmp:
+            json.dump(tokens, tmp)
+        os.replace(tmp_path, self.path)
 
-        self.token_data = self.client.generate_token()
-        self.account = self.client.account_api(id=os.getenv('NORDIGEN_ACCOUNT_ID'))
+class TransactionService:
+    """
+    Nordigen access for the accounts in NORDIGEN_ACCOUNT_IDS (comma
+    separated, or the single NORDIGEN_ACCOUNT_ID). Per-account calls run
+    concurrently on a bounded thread pool. The client is built on first
+    use, and the access token is reused until it is close to expiry, then
+    refreshed with the refresh token, and only regenerated once both have
+    expired.
+    """
+
+    # Renew tokens this long before they expire
+    EXPIRY_MARGIN = timedelta(minutes=5)
 
-    def get_transactions(self, date_from: str, date_to: str):
-        transactions = self.account.get_transactions(date_from=date_from, date_to=date_to)
+    def __init__(self):
+        account_ids = os.getenv('NORDIGEN_ACCOUNT_IDS') or os.getenv('NORDIGEN_ACCOUNT_ID') or ''
+        self.account_ids = [account_id.strip() for account_id in account_ids.split(',') if account_id.strip()]
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('NORDIGEN_WORKERS', 4)), thread_name_prefix='nordigen'
+        )
+        self.token_store = TokenStore(os.getenv('NORDIGEN_TOKEN_PATH', 'instance/nordigen_token.json'))
+        self._client = None
+        self._accounts = {}
+        self._tokens = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = PooledNordigenClient(
+                    secret_id=os.getenv('NORDIGEN_SECRET_ID'),
+                    secret_key=os.getenv('NORDIGEN_SECRET_KEY')
+                )
+            self.ensure_token(self._client)
+            return self._client
+
+    def account(self, account_id):
+        client = self.client
+        if account_id not in self._accounts:
+            self._accounts[account_id] = client.account_api(id=account_id)
+        return self._accounts[account_id]
+
+    def map_accounts(self, func, account_ids=None, return_exceptions=False):
+        """
+        Call func(account_id) for every account concurrently and return
+        {account_id: result}. With return_exceptions, a failing account maps
+        to its exception instead of failing the whole call.
+        """
+        account_ids = self.account_ids if account_ids is None else account_ids
+        futures = {account_id: self.executor.submit(func, account_id) for account_id in account_ids}
+        results = {}
+        for account_id, future in futures.items():
+            try:
+                results[account_id] = future.result()
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results[account_id] = e
+        return results
+
+    def ensure_token(self, client):
+        """Give client a valid access token, refreshing or generating one if needed."""
+        if self._tokens is None:
+            self._tokens = self.token_store.load()
+        tokens = self._tokens
+        now = datetime.now()
+        valid = lambda key: tokens.get(key) and datetime.fromisoformat(tokens[key]) - self.EXPIRY_MARGIN > now
+
+        if valid('access_expires_at'):
+            if client.token != tokens['access']:
+                client.token = tokens['access']
+            return
+        if valid('refresh_expires_at'):
+            response = client.exchange_token(tokens['refresh'])
+        else:
+            response = client.generate_token()
+            tokens['refresh'] = response['refresh']
+            tokens['refresh_expires_at'] = (now + timedelta(seconds=response['refresh_expires'])).isoformat()
+        tokens['access'] = response['access']
+        tokens['access_expires_at'] = (now + timedelta(seconds=response['access_expires'])).isoformat()
+        self.token_store.save(tokens)
+
+    def get_transactions(self, account_id: str, date_from: str, date_to: str):
+        transactions = self.account(account_id).get_transactions(date_from=date_from, date_to=date_to)
         return transactions
 
+    def fetch_transactions(self, ranges: dict):
+        """Fetch {account_id: (date_from, date_to)} concurrently; failures map to exceptions."""
+        return self.map_accounts(
+            lambda account_id: self.get_transactions(account_id, *ranges[account_id]),
+            account_ids=list(ranges), return_exceptions=True
+        )
+
     def get_balances(self):
-        balances = self.account.get_balances()
-        return balances
+        """
+        Balances per account plus combined totals per currency of the
+        accounts that answered. A failing account is reported as
+        {'error': ...} and left out of the totals; if all fail, raises.
+        """
+        results = self.map_accounts(lambda account_id: self.account(account_id).get_balances(), return_exceptions=True)
+        failed = {account_id: e for account_id, e in results.items() if isinstance(e, Exception)}
+        if failed and len(failed) == len(results):
+            account_id, error = next(iter(failed.items()))
+            raise RuntimeError(f"Failed to fetch balances for {', '.join(failed)}: {error}") from error
+
+        accounts, totals = {}, {}
+        for account_id, balances in results.items():
+            if account_id in failed:
+                accounts[account_id] = {'error': str(balances)}
+                continue
+            accounts[account_id] = balances
+            amount = primary_balance(balances.get('balances', []))
+            if amount:
+                currency = amount['currency']
+                totals[currency] = round(totals.get(currency, 0.0) + float(amount['amount']), 2)
+        return {'accounts': accounts, 'totals': totals, 'failed': len(failed)}
 
     def get_details(self):
-        details = self.account.get_details()
-        return details
+        return self.map_accounts(lambda account_id: self.account(account_id).get_details())
 
     def get_metadata(self):
-        meta_data = self.account.get_metadata()
-        return meta_data
+        return self.map_accounts(lambda account_id: self.account(account_id).get_metadata())
 
     def get_all(self, date_from: str, date_to: str):
         return {
             'metadata': self.get_metadata(),
             'details': self.get_details(),
             'balances': self.get_balances(),
-            'transactions': self.get_transactions(date_from, date_to)
+            'transactions': self.map_accounts(lambda account_id: self.get_transactions(account_id, date_from, date_to))
         }
 
+# Preferred balance types when an account reports several
+BALANCE_TYPES = ('interimAvailable', 'expected', 'closingBooked', 'interimBooked')
+
+def primary_balance(balances):
+    """Return the balanceAmount of the most relevant balance, or None."""
+    for balance_type in BALANCE_TYPES:
+        for balance in balances:
+            if balance.get('balanceType') == balance_type:
+                return balance['balanceAmount']
+    return balances[0]['balanceAmount'] if balances else None
+
 
 # client = NordigenClient(
 #     secret_id=os.getenv('NORDIGEN_SECRET_ID'),
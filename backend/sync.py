@@ -0,0 +1,99 @@
+# sync.py
+
+from sqlalchemy.dialects.sqlite import insert
+from models import db, Transaction, SyncState
+from datetime import datetime, timedelta
+
+# Days before the watermark to fetch again, since banks can book a
+# transaction with an earlier date after later ones have been seen.
+# Rows already stored are skipped by the unique transaction_id.
+OVERLAP_DAYS = 3
+INITIAL_DAYS = 90
+
+def watermark_key(account_id):
+    return f'transactions:{account_id}:watermark'
+
+SYNCED_AT_KEY = 'transactions:synced_at'
+
+def last_synced_at():
+    synced_at = SyncState.get(SYNCED_AT_KEY)
+    return datetime.fromisoformat(synced_at) if synced_at else None
+
+def transaction_row(transaction, account_id):
+    """Map a booked Nordigen transaction to a transactions row, or None without an id."""
+    transaction_id = transaction.get('internalTransactionId') or transaction.get('transactionId')
+    if not transaction_id:
+        return None
+    return {
+        'transaction_id': transaction_id,
+        'account_id': account_id,
+        'date': datetime.strptime(transaction.get('bookingDate'), '%Y-%m-%d').date(),
+        'amount': float(transaction.get('transactionAmount').get('amount')),
+        'description': transaction.get('remittanceInformationUnstructured'),
+        'debtor': transaction.get('debtorName'),
+        'additional_info': transaction.get('additionalInformation'),
+    }
+
+def fetch_range(account_id):
+    """The (date_from, date_to) to fetch for an account, based on its watermark."""
+    watermark = SyncState.get(watermark_key(account_id))
+    if watermark:
+        date_from = datetime.strptime(watermark, '%Y-%m-%d').date() - timedelta(days=OVERLAP_DAYS)
+    else:
+        date_from = datetime.today().date() - timedelta(days=INITIAL_DAYS)
+    return date_from, datetime.today().date()
+
+def store_transactions(account_id, booked):
+    """Insert an account's booked transactions in a single statement and advance its watermark."""
+    rows = {}
+    for transaction in booked:
+        row = transaction_row(transaction, account_id)
+        if row:
+            rows[row['transaction_id']] = row
+
+    inserted = 0
+    if rows:
+        # Core insert, executed with every row at once, so rowcount counts the new ones
+        statement = insert(Transaction.__table__).on_conflict_do_nothing(index_elements=['transaction_id'])
+        inserted = db.session.execute(statement, list(rows.values())).rowcount
+        SyncState.set(watermark_key(account_id), max(row['date'] for row in rows.values()).isoformat())
+    return inserted
+
+def sync_transactions(service):
+    """
+    Fetch every account's booked transactions since its watermark, all
+    accounts concurrently, and insert the new ones. Returns per-account and
+    total counts of fetched, inserted and skipped rows. An account that
+    fails is reported and retried on the next sync; if all fail, raises.
+    """
+    ranges = {account_id: fetch_range(account_id) for account_id in service.account_ids}
+    responses = service.fetch_transactions({
+        account_id: (date_from.isoformat(), date_to.isoformat())
+        for account_id, (date_from, date_to) in ranges.items()
+    })
+
+    accounts = []
+    for account_id, response in responses.items():
+        date_from, date_to = ranges[account_id]
+        result = {'account_id': account_id, 'date_from': date_from.isoformat(), 'date_to': date_to.isoformat()}
+        if isinstance(response, Exception):
+            result['error'] = str(response)
+        else:
+            booked = response.get('transactions', {}).get('booked', [])
+            inserted = store_transactions(account_id, booked)
+            result.update(fetched=len(booked), inserted=inserted, skipped=len(booked) - inserted)
+        accounts.append(result)
+
+    failed = [result for result in accounts if 'error' in result]
+    if failed and len(failed) == len(accounts):
+        db.session.rollback()
+        raise RuntimeError(f"Failed to sync {', '.join(result['account_id'] for result in failed)}: {failed[0]['error']}")
+    SyncState.set(SYNCED_AT_KEY, datetime.now().isoformat())
+    db.session.commit()
+
+    return {
+        'accounts': accounts,
+        'inserted': sum(result.get('inserted', 0) for result in accounts),
+        'skipped': sum(result.get('skipped', 0) for result in accounts),
+        'failed': len(failed),
+    }
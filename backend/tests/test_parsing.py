@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+import fitz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.parsing import ParsingEngine
+
+
+def make_pdf(path):
+    with fitz.open() as pdf_file:
+        page = pdf_file.new_page()
+        page.insert_text((72, 72), 'Faktura 123 Att betala 100,00 kr')
+        pdf_file.save(path)
+
+
+class ParsingEngineRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.tmp.name, 'invoice.pdf')
+        make_pdf(self.pdf_path)
+        self.engine = ParsingEngine(workers=1, timeout=20)
+
+    def tearDown(self):
+        self.engine.shutdown()
+        self.tmp.cleanup()
+
+    def test_parses_after_a_worker_crashes(self):
+        crashed = self.engine.pool
+        crashed.submit(os._exit, 1)
+        # The first read may still see the broken pool; later ones must not
+        try:
+            self.engine.read(self.pdf_path)
+        except Exception:
+            pass
+        self.assertIsNotNone(self.engine.read(self.pdf_path))
+        self.assertIsNot(self.engine.pool, crashed)
+
+    def test_parses_after_a_timeout(self):
+        self.engine.timeout = 1
+        hung = self.engine.pool
+        hung.submit(time.sleep, 60)
+        with self.assertRaises(TimeoutError):
+            self.engine.read(self.pdf_path)
+
+        self.engine.timeout = 20
+        self.assertIsNotNone(self.engine.read(self.pdf_path))
+        self.assertIsNot(self.engine.pool, hung)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,19 @@ const GET = async (path: string) => {
     return response.json();
 };
 
+// Follows the X-Next-Cursor header through every page of a list endpoint
+const GET_ALL = async (path: string) => {
+    const items: any[] = [];
+    let cursor: string | null = null;
+    do {
+        const separator = path.includes('?') ? '&' : '?';
+        const response = await fetch(`${baseUrl}${path}${cursor ? `${separator}after=${cursor}` : ''}`);
+        items.push(...await response.json());
+        cursor = response.headers.get('X-Next-Cursor');
+    } while (cursor);
+    return items;
+};
+
 const POST = async (path: string, data: any) => {
     const response = await fetch(`${baseUrl}${path}`, {
         method: 'POST',
@@ -36,13 +49,17 @@ export const DELETE = async (path: string) => {
 };
 
 export const getAllInvoices = async () => {
-    return GET('/invoices');
+    return GET_ALL('/invoices');
 }
 
 export const getInvoice = async (id: number) => {
     return GET(`/invoices/${id}`);
 }
 
+export const getInvoicePdfUrl = (id: number) => {
+    return `${baseUrl}/invoices/${id}/pdf`;
+}
+
 export const createInvoice = async (data: any) => {
     return POST('/invoices', data);
 }
@@ -60,7 +77,7 @@ export const getStatistics = async () => {
 }
 
 export const getAllExpenses = async () => {
-    return GET('/expenses');
+    return GET_ALL('/expenses');
 }
 
 export const createExpense = async (data: any) => {
@@ -83,12 +100,26 @@ export const getTransactions = async (fromDate: string, toDate: string) => {
     return GET(`/transactions/${fromDate}/${toDate}`);
 }
 
+export const syncTransactions = async () => {
+    return POST('/transactions/sync', {});
+}
+
 export const getBalance = async () => {
     return GET('/balance');
 }
 
 export const getEmails = async () => {
-    return GET('/emails');
+    return GET_ALL('/emails');
+}
+
+export const search = async (query: string, types: string[] = []) => {
+    const params = new URLSearchParams({ q: query });
+    if (types.length) params.set('types', types.join(','));
+    return GET(`/search?${params}`);
+}
+
+export const getEmail = async (id: number) => {
+    return GET(`/emails/${id}`);
 }
 
 export const deleteEmail = async (id: number) => {
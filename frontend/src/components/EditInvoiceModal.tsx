@@ -30,7 +30,7 @@ interface InvoiceData {
   issuer: string;
   needs_completion: boolean;
   ocr: string;
-  pdf_data: string;
+  pdf_url: string | null;
   plusgiro: string;
   status: boolean; // false = unpaid, true = paid
 }
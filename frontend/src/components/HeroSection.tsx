@@ -5,7 +5,7 @@ import { useEffect, useState } from 'react';
 import { PieChart, Pie, Cell, ResponsiveContainer } from 'recharts';
 import { ArrowUpRight, ArrowDownRight } from 'lucide-react';
 import { Card, CardContent } from '@/components/ui/card';
-import { getStatistics } from '../api';
+import { getStatistics, getBalance } from '../api';
 
 interface PieChartData {
   name: string;
@@ -22,14 +22,20 @@ export default function HeroSection() {
       result.total_invoices_amount = result.total_invoices_amount || 0;
       result.total_expenses = result.total_expenses || 0;
       result.total_income = result.total_income || 0;
-      result.balance.balances[0].balanceAmount.amount = parseFloat(result.balance.balances[0].balanceAmount.amount) || 0;
-      const pieChartData = [
-        { name: 'Balance', value: result.balance.balances[0].balanceAmount.amount, color: '#22c55e' },
-        { name: 'To be paid', value: result.total_invoices_amount + result.total_expenses, color: '#ff474c' },
-        { name: 'P / L', value: result.balance.balances[0].balanceAmount.amount + result.total_income - result.total_invoices_amount - result.total_expenses, color: '#000000' },
-      ];
-      console.log(pieChartData);
-      setIncomeData(pieChartData);
+      const showBalance = (balanceResult: any) => {
+        // Combined balance across accounts, in the first reported currency
+        const balance = Number(Object.values(balanceResult?.totals ?? {})[0]) || 0;
+        setIncomeData([
+          { name: 'Balance', value: balance, color: '#22c55e' },
+          { name: 'To be paid', value: result.total_invoices_amount + result.total_expenses, color: '#ff474c' },
+          { name: 'P / L', value: balance + result.total_income - result.total_invoices_amount - result.total_expenses, color: '#000000' },
+        ]);
+      };
+      showBalance(result.balance);
+      // Statistics only carry a cached balance, so ask for a fresh one when there is none
+      if (!result.balance) {
+        getBalance().then(showBalance).catch(() => {});
+      }
     });
   }, []);
 
@@ -9,7 +9,7 @@ import { getAllInvoices, getAllExpenses } from '../api';
 import EditInvoiceModal from './EditInvoiceModal';
 import EditExpenseModal from './EditExpenseModal';
 import { useToast } from '@/hooks/use-toast';
-import { getInvoice } from '../api';
+import { getInvoicePdfUrl } from '../api';
 import { Eye } from 'lucide-react';
 import PayDialog from './PayDialog';
 
@@ -21,27 +21,6 @@ export default function InvoicesSection() {
   const [expenses, setExpenses] = useState<any[]>([]);
   const [showPaid, setShowPaid] = useState(false);
 
-  function base64ToBlob(base64Data: string, contentType: string) {
-    const byteCharacters = atob(base64Data);
-    const byteArrays = [];
-  
-    for (let offset = 0; offset < byteCharacters.length; offset += 512) {
-      const slice = byteCharacters.slice(offset, offset + 512);
-  
-      const byteNumbers = new Array(slice.length);
-      for (let i = 0; i < slice.length; i++) {
-        byteNumbers[i] = slice.charCodeAt(i);
-      }
-  
-      const byteArray = new Uint8Array(byteNumbers);
-  
-      byteArrays.push(byteArray);
-    }
-  
-    const blob = new Blob(byteArrays, { type: contentType });
-    return blob;
-  }
-  
     const handleViewPDF = (id?: number) => {
       if (!id) {
         toast({
@@ -52,16 +31,7 @@ export default function InvoicesSection() {
         return;
       }
 
-      getInvoice(id).then((data) => {
-        const base64Data = data.pdf_data;
-        const contentType = 'application/pdf';
-        const blob = base64ToBlob(base64Data, contentType);
-        const blobUrl = URL.createObjectURL(blob);
-        window.open(blobUrl, '_blank');
-        setTimeout(() => {
-          URL.revokeObjectURL(blobUrl);
-        }, 1000 * 60);
-      });
+      window.open(getInvoicePdfUrl(id), '_blank');
     };
 
   useEffect(() => {
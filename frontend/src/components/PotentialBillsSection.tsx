@@ -46,6 +46,8 @@ export default function PotentialBillsSection() {
                 <Mail className="w-5 h-5 mr-2 text-gray-400" />
                 <div>
                   <p className="font-medium">{email.subject}</p>
+                  {email.sender && <p className="text-sm text-gray-500">{email.sender}</p>}
+                  {email.snippet && <p className="text-sm text-gray-500 line-clamp-1">{email.snippet}</p>}
                 </div>
               </div>
               <div className="flex items-center">
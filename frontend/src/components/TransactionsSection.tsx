@@ -9,11 +9,13 @@ import { getTransactions } from '@/api';
 export default function TransactionsSection() {
 
   const [transactions, setTransactions] = useState<any[]>([]);
+  const [lastSyncedAt, setLastSyncedAt] = useState<string | null>(null);
 
   useEffect(() => {
     getTransactions('2024-08-01', '2024-09-01')
       .then((data) => {
-        setTransactions(data);
+        setTransactions(data.transactions);
+        setLastSyncedAt(data.last_synced_at);
       })
       .catch((error) => {
         console.error(error);
@@ -27,7 +29,10 @@ export default function TransactionsSection() {
     <Card>
       <CardHeader>
         <CardTitle>Transactions</CardTitle>
-        <CardDescription>Your recent financial activities</CardDescription>
+        <CardDescription>
+          Your recent financial activities
+          {lastSyncedAt && ` · Synced ${new Date(lastSyncedAt).toLocaleString()}`}
+        </CardDescription>
       </CardHeader>
       <CardContent>
         <Tabs defaultValue="all" className="w-full">